@@ -5,6 +5,7 @@ import streamlit as st
 from insightface.app import FaceAnalysis
 from streamlit_webrtc import webrtc_streamer, VideoTransformerBase
 from models import SmallFaceRecognitionTransformer, FaceRecognitionTransformer
+from quality import FaceQualityGate, MIN_DET_SCORE, MIN_FACE_SIZE, MAX_YAW, MAX_PITCH, MIN_SHARPNESS
 
 
 KNOWN_FACES_DIR = "known_faces"
@@ -89,26 +90,55 @@ with st.sidebar:
     ### Application Information
     - **Video Streaming**: streamlit-webrtc
     """)
+    st.markdown("---")
+    st.subheader("Face Quality Gate")
+    use_quality_gate = st.checkbox("Skip low-quality faces before recognition", value=True)
+    gate_config = {
+        "min_det_score": st.slider("Min detector score", 0.0, 1.0, MIN_DET_SCORE, 0.05, disabled=not use_quality_gate),
+        "min_face_size": st.slider("Min face size (px)", 0, 200, MIN_FACE_SIZE, 5, disabled=not use_quality_gate),
+        "max_yaw": st.slider("Max yaw (deg)", 0.0, 90.0, MAX_YAW, 5.0, disabled=not use_quality_gate),
+        "max_pitch": st.slider("Max pitch (deg)", 0.0, 90.0, MAX_PITCH, 5.0, disabled=not use_quality_gate),
+        "min_sharpness": st.slider("Min sharpness", 0.0, 200.0, MIN_SHARPNESS, 5.0, disabled=not use_quality_gate),
+    }
+
+
+def make_gate():
+    # One gate per feed so each reports its own savings
+    return FaceQualityGate(**gate_config) if use_quality_gate else None
+
+
+def show_gate_stats(ctx, label: str):
+    transformer = ctx.video_transformer if ctx is not None else None
+    if transformer is None or transformer.quality_gate is None:
+        return
+    stats = transformer.quality_gate.stats()
+    st.caption(f"{label}: {stats['recognitions_saved']} of {stats['checked']} faces skipped by the quality gate "
+               f"(det_score {stats['rejected_det_score']}, size {stats['rejected_size']}, "
+               f"pose {stats['rejected_pose']}, blur {stats['rejected_blur']})")
     
 st.markdown("<h1 class='title'>Hybrid Edge-Cloud AI Surveillance</h1>", unsafe_allow_html=True)
 st.markdown("<h3 style='text-align: center; color: #85C1E9;'>Real-Time Face Recognition</h3>", unsafe_allow_html=True)
 
 st.markdown("<div class='card'>", unsafe_allow_html=True)
 st.subheader("📹 Live Recognition Feed")
-webrtc_streamer(
+large_ctx = webrtc_streamer(
     key="face-recognition",
-    video_transformer_factory=FaceRecognitionTransformer,
+    video_transformer_factory=lambda: FaceRecognitionTransformer(quality_gate=make_gate()),
     rtc_configuration={"iceServers": [{"urls": ["stun:stun.l.google.com:19302"]}]},
     media_stream_constraints={"video": True, "audio": False},
 )
 
-webrtc_streamer(
+small_ctx = webrtc_streamer(
     key="small-face-recognition",
-    video_transformer_factory=SmallFaceRecognitionTransformer,
+    video_transformer_factory=lambda: SmallFaceRecognitionTransformer(quality_gate=make_gate()),
     rtc_configuration={"iceServers": [{"urls": ["stun:stun.l.google.com:19302"]}]},
     media_stream_constraints={"video": True, "audio": False},
 )
 
+show_gate_stats(large_ctx, MODEL_NAME)
+show_gate_stats(small_ctx, SMALL_MODEL_NAME)
+st.button("Refresh quality stats")
+
 st.markdown("</div>", unsafe_allow_html=True)
 
 # Footer
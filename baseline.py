@@ -1,122 +1,385 @@
 import os
+import sys
+import json
+import time
+import signal
+import argparse
+import threading
+from typing import List, Optional
+
 import cv2
 import numpy as np
 from insightface.app import FaceAnalysis
+from quality import FaceQualityGate
 
 # Configuration
 KNOWN_FACES_DIR = "known_faces"  # folder containing known face images
 MODEL_NAME = 'buffalo_s'         # InsightFace model pack: 'buffalo_l' (default) or 'buffalo_s' for faster, etc.
 PROVIDERS = ['CUDAExecutionProvider', 'CPUExecutionProvider']  # GPU if available, else CPU
+SIMILARITY_THRESHOLD = 0.3       # require similarity above this to confirm identity
+
+
+def load_model(model_name: str = MODEL_NAME, det_size=(640, 640)) -> FaceAnalysis:
+    # Initialize InsightFace model (face detector + recognizer)
+    # ctx_id=0 uses GPU 0 if available; on CPU-only systems, it will fallback to CPU due to providers setting.
+    # det_size=(640,640) is the size for face detection, can adjust for speed vs accuracy.
+    app = FaceAnalysis(name=model_name, providers=PROVIDERS)
+    app.prepare(ctx_id=0, det_size=det_size)
+    return app
+
+
+def load_known_faces(app: FaceAnalysis, directory: str = KNOWN_FACES_DIR):
+    """Encode every image in `directory` and average them into one embedding per person."""
+    known_embeddings = []  # list of embedding vectors (normalized)
+    known_names = []       # list of corresponding names
+
+    if not os.path.exists(directory):
+        return np.empty((0, 512), dtype=np.float32), []
 
-# Initialize InsightFace model (face detector + recognizer)
-app = FaceAnalysis(name=MODEL_NAME, providers=PROVIDERS)
-app.prepare(ctx_id=0, det_size=(640, 640))
-# ctx_id=0 uses GPU 0 if available; on CPU-only systems, it will fallback to CPU due to providers setting.
-# det_size=(640,640) is the size for face detection, can adjust for speed vs accuracy.
-
-# Load and encode known faces
-known_embeddings = []  # list of embedding vectors (normalized)
-known_names = []       # list of corresponding names
-
-for file_name in os.listdir(KNOWN_FACES_DIR):
-    if file_name.lower().endswith(('.jpg', '.png', '.jpeg')):
-        img_path = os.path.join(KNOWN_FACES_DIR, file_name)
-        name = file_name.split('_')[0]  # extract the label/name before the first underscore
-        # Read the image
-        img = cv2.imread(img_path)
-        if img is None:
-            continue  # skip if image not readable
-        # Get face and embedding
-        faces = app.get(img)
-        if len(faces) == 0:
-            print(f"Warning: No face found in {file_name}, skipping this image.")
-            continue
-        # If multiple faces detected, optionally skip or take the largest face
-        face = faces[0]  # take the first face (highest confidence)
-        # Use the normalized embedding (L2 normed vector of length 512)
-        emb = face.normed_embedding  if hasattr(face, 'normed_embedding') else face.embedding
-        emb = emb.flatten()  # ensure it's a 1D numpy array
-        # Store the embedding and name
-        known_embeddings.append(emb)
-        known_names.append(name)
-
-# If there are multiple images of the same person, average their embeddings for a single representative
-# We can compute an average for each name and replace entries accordingly
-if known_names:
+    for file_name in os.listdir(directory):
+        if file_name.lower().endswith(('.jpg', '.png', '.jpeg')):
+            img_path = os.path.join(directory, file_name)
+            name = file_name.split('_')[0]  # extract the label/name before the first underscore
+            img = cv2.imread(img_path)
+            if img is None:
+                continue  # skip if image not readable
+            faces = app.get(img)
+            if len(faces) == 0:
+                print(f"Warning: No face found in {file_name}, skipping this image.", file=sys.stderr)
+                continue
+            face = faces[0]  # take the first face (highest confidence)
+            # Use the normalized embedding (L2 normed vector of length 512)
+            emb = face.normed_embedding if hasattr(face, 'normed_embedding') else face.embedding
+            known_embeddings.append(emb.flatten())
+            known_names.append(name)
+
+    # If there are multiple images of the same person, average their embeddings for a single representative
     avg_embeddings = {}
     for name, emb in zip(known_names, known_embeddings):
         avg_embeddings.setdefault(name, []).append(emb)
-    # Now average and normalize
-    known_embeddings = []
-    known_names = []
-    for name, emb_list in avg_embeddings.items():
-        # Compute average embedding
-        avg_emb = np.mean(np.vstack(emb_list), axis=0)
-        # L2 normalize the averaged embedding
-        norm = np.linalg.norm(avg_emb)
-        if norm > 0:
-            avg_emb = avg_emb / norm
-        known_embeddings.append(avg_emb)
-        known_names.append(name)
-    print(f"Loaded {len(known_names)} individuals from {KNOWN_FACES_DIR}")
-else:
-    print("No known faces found. Please add images to the known faces directory.")
-    # If no known faces, we can exit or proceed with only unknown identification.
-
-# Start webcam video capture
-cap = cv2.VideoCapture(0)
-if not cap.isOpened():
-    print("Error: Could not open webcam.")
-    exit(1)
-
-print("Starting video stream... Press 'q' to quit.")
-while True:
-    ret, frame = cap.read()
-    if not ret:
-        print("Failed to grab frame. Exiting...")
-        break
-
-    # Perform face detection and get face embeddings for the frame
-    faces = app.get(frame)
-    # Loop over detected faces
-    for face in faces:
-        bbox = face.bbox.astype(int)  # bounding box coordinates (x1, y1, x2, y2)
-        x1, y1, x2, y2 = bbox[0], bbox[1], bbox[2], bbox[3]
-        # Get the embedding for this face
-        emb = face.normed_embedding if hasattr(face, 'normed_embedding') else face.embedding
-        emb = emb.flatten()
-        # Normalize the embedding (just in case it's not already normalized)
-        norm = np.linalg.norm(emb)
-        if norm > 0:
-            emb = emb / norm
-
-        # Identify the face by finding the closest known face (highest cosine similarity)
-        identity = "Unknown"
-        best_sim = -1  # highest similarity score
-        for known_name, known_emb in zip(known_names, known_embeddings):
-            # Compute cosine similarity as dot product (since embeddings are normalized)
-            sim = np.dot(emb, known_emb)
-            if sim > best_sim:
-                best_sim = sim
-                identity = known_name
-        # Threshold for recognition: require similarity above 0.3 to confirm identity
-        if best_sim < 0.3:
-            identity = "Unknown"
-
-        # Draw bounding box and name on the frame
-        color = (0, 255, 0) if identity != "Unknown" else (0, 0, 255)  # green for known, red for unknown
-        cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
-        # Text label (display name and maybe similarity)
-        label = f"{identity}" if identity == "Unknown" else f"{identity}"
-        # Position the label above the top-left corner of the face rectangle
-        cv2.putText(frame, label, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2)
-
-    # Show the annotated frame in a window
-    cv2.imshow("Face Recognition", frame)
-    # Exit on 'q' key
-    if cv2.waitKey(1) & 0xFF == ord('q'):
-        break
-
-# Clean up resources
-cap.release()
-cv2.destroyAllWindows()
+    names = list(avg_embeddings)
+    if not names:
+        print("No known faces found. Please add images to the known faces directory.", file=sys.stderr)
+        return np.empty((0, 512), dtype=np.float32), []
+    gallery = np.stack([np.mean(np.vstack(avg_embeddings[n]), axis=0) for n in names])
+    gallery /= np.maximum(np.linalg.norm(gallery, axis=1, keepdims=True), 1e-12)
+    print(f"Loaded {len(names)} individuals from {directory}", file=sys.stderr)
+    return gallery.astype(np.float32), names
+
+
+def parse_source(source: str):
+    """Device index ("0"), video file path, or stream URL (rtsp://, http://, ...)."""
+    return int(source) if source.isdigit() else source
+
+
+# --------------------------
+# Capture Thread
+# --------------------------
+class LatestFrameCapture(threading.Thread):
+    """Reads a source on its own thread and keeps only the most recent frame.
+
+    Camera I/O then overlaps with inference instead of adding to it, and a slow
+    recognizer skips stale frames rather than falling further behind. Files are
+    paced at their native frame rate so they behave like a live camera.
+    """
+
+    def __init__(self, source: str, name: Optional[str] = None, loop: bool = False,
+                 new_frame: Optional[threading.Condition] = None):
+        super().__init__(name=f"capture-{name or source}", daemon=True)
+        self.source = source
+        self.stream_name = name or str(source)
+        self.loop = loop
+        self.new_frame = new_frame or threading.Condition()
+        self.stop_event = threading.Event()
+        self.frame = None
+        self.frame_id = 0          # Increments on every frame read
+        self.frame_time = 0.0      # Wall-clock time the latest frame was read
+        self.frames_read = 0
+        self.finished = False      # Source exhausted or failed
+
+        self.cap = cv2.VideoCapture(parse_source(source))
+        if not self.cap.isOpened():
+            raise RuntimeError(f"Could not open capture source {source!r}")
+        self.is_file = isinstance(parse_source(source), str) and os.path.exists(source)
+        fps = self.cap.get(cv2.CAP_PROP_FPS) if self.is_file else 0
+        self.frame_interval = 1.0 / fps if fps and fps > 0 else 0.0
+        self.source_fps = fps or None
+
+    def run(self):
+        next_time = time.monotonic()
+        try:
+            while not self.stop_event.is_set():
+                ret, frame = self.cap.read()
+                if not ret:
+                    if self.is_file and self.loop:
+                        self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                        continue
+                    break
+                with self.new_frame:
+                    self.frame = frame
+                    self.frame_id += 1
+                    self.frame_time = time.time()
+                    self.frames_read += 1
+                    self.new_frame.notify_all()
+                if self.frame_interval:
+                    next_time += self.frame_interval
+                    delay = next_time - time.monotonic()
+                    if delay > 0:
+                        self.stop_event.wait(delay)
+                    else:
+                        next_time = time.monotonic()
+        finally:
+            self.cap.release()
+            with self.new_frame:
+                self.finished = True
+                self.new_frame.notify_all()
+
+    def latest(self):
+        """(frame_id, capture_time, frame) for the newest frame; frame may be None."""
+        with self.new_frame:
+            return self.frame_id, self.frame_time, self.frame
+
+    def stop(self):
+        self.stop_event.set()
+
+
+# --------------------------
+# Annotated Video Output
+# --------------------------
+class TimedVideoWriter:
+    """Writes frames at a fixed rate, holding each one until the next frame's capture time.
+
+    The worker only annotates the frames it gets to, at whatever rate it manages,
+    so frames are placed by timestamp rather than written back to back.
+    """
+
+    def __init__(self, path: str, fps: float, size):
+        self.writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+        self.fps = fps
+        self.start = None
+        self.written = 0
+        self.held = None
+
+    def write(self, frame: np.ndarray, frame_time: float):
+        if self.start is None:
+            self.start = frame_time
+        # Fill every slot up to this frame's time with the previous frame
+        slot = int((frame_time - self.start) * self.fps)
+        while self.held is not None and self.written < slot:
+            self.writer.write(self.held)
+            self.written += 1
+        self.held = frame
+
+    def release(self):
+        if self.held is not None:
+            self.writer.write(self.held)
+        self.writer.release()
+
+
+# --------------------------
+# Recognition Worker
+# --------------------------
+class RecognitionWorker(threading.Thread):
+    """Pulls the newest unprocessed frame from each capture, recognizes and reports it."""
+
+    def __init__(self, app: FaceAnalysis, gallery: np.ndarray, names: List[str], captures: List[LatestFrameCapture],
+                 new_frame: threading.Condition, threshold: float = SIMILARITY_THRESHOLD,
+                 max_fps: Optional[float] = None, quality_gate: Optional[FaceQualityGate] = None,
+                 output=None, video_dir: Optional[str] = None, display: bool = False):
+        super().__init__(name="recognition", daemon=True)
+        self.app = app
+        self.gallery = gallery
+        self.names = names
+        self.captures = captures
+        self.new_frame = new_frame
+        self.threshold = threshold
+        self.min_interval = 1.0 / max_fps if max_fps else 0.0
+        self.quality_gate = quality_gate
+        self.output = output
+        self.video_dir = video_dir
+        self.display = display
+        self.stop_event = threading.Event()
+        self.last_id = {c.stream_name: 0 for c in captures}
+        self.next_allowed = {c.stream_name: 0.0 for c in captures}
+        self.processed = {c.stream_name: 0 for c in captures}
+        self.writers = {}
+        self.display_frames = {}
+        self.display_lock = threading.Lock()
+
+    def run(self):
+        try:
+            while not self.stop_event.is_set():
+                did_work = False
+                for cap in self.captures:
+                    now = time.monotonic()
+                    if now < self.next_allowed[cap.stream_name]:
+                        continue
+                    frame_id, frame_time, frame = cap.latest()
+                    if frame is None or frame_id == self.last_id[cap.stream_name]:
+                        continue
+                    self.last_id[cap.stream_name] = frame_id
+                    self.next_allowed[cap.stream_name] = now + self.min_interval
+                    self.process(cap, frame_id, frame_time, frame)
+                    did_work = True
+
+                if not did_work:
+                    if all(c.finished for c in self.captures) and self._drained():
+                        break
+                    # Sleep until a capture publishes a frame or the next throttle slot opens
+                    wake = min(self.next_allowed.values()) - time.monotonic()
+                    with self.new_frame:
+                        self.new_frame.wait(timeout=min(max(wake, 0.001), 0.1))
+        finally:
+            for writer in self.writers.values():
+                writer.release()
+
+    def _drained(self) -> bool:
+        return all(c.latest()[0] == self.last_id[c.stream_name] for c in self.captures)
+
+    def process(self, cap: LatestFrameCapture, frame_id: int, frame_time: float, frame: np.ndarray):
+        annotate = self.video_dir is not None or self.display
+        if annotate:
+            frame = frame.copy()  # The capture thread owns its buffer
+
+        # Perform face detection and get face embeddings for the frame
+        faces = self.quality_gate.get(self.app, frame) if self.quality_gate else self.app.get(frame)
+        results = []
+        for face in faces:
+            x1, y1, x2, y2 = [int(v) for v in face.bbox]
+            emb = face.normed_embedding if hasattr(face, 'normed_embedding') else face.embedding
+            identity, best_sim = "Unknown", -1.0
+            if emb is None:
+                identity = "Low quality"
+            elif len(self.names):
+                # Cosine similarity as dot product against the whole gallery at once
+                sims = self.gallery @ emb.flatten()
+                best = int(np.argmax(sims))
+                best_sim = float(sims[best])
+                if best_sim >= self.threshold:
+                    identity = self.names[best]
+            results.append({"identity": identity, "similarity": round(best_sim, 3),
+                            "det_score": round(float(face.det_score), 3), "bbox": [x1, y1, x2, y2]})
+
+            if annotate:
+                # green for known, red for unknown, grey for skipped
+                if identity == "Low quality":
+                    color = (128, 128, 128)
+                else:
+                    color = (0, 255, 0) if identity != "Unknown" else (0, 0, 255)
+                cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+                cv2.putText(frame, identity, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2)
+
+        self.processed[cap.stream_name] += 1
+        if self.output is not None:
+            record = {"ts": round(frame_time, 3), "source": cap.stream_name, "frame": frame_id,
+                      "latency_ms": round((time.time() - frame_time) * 1000, 1), "faces": results}
+            self.output.write(json.dumps(record) + "\n")
+            self.output.flush()
+
+        if self.video_dir is not None:
+            self._write_video(cap, frame, frame_time)
+        if self.display:
+            with self.display_lock:
+                self.display_frames[cap.stream_name] = frame
+
+    def _write_video(self, cap: LatestFrameCapture, frame: np.ndarray, frame_time: float):
+        writer = self.writers.get(cap.stream_name)
+        if writer is None:
+            os.makedirs(self.video_dir, exist_ok=True)
+            safe = "".join(ch if ch.isalnum() or ch in "-_" else "_" for ch in cap.stream_name)
+            path = os.path.join(self.video_dir, f"{safe}.mp4")
+            h, w = frame.shape[:2]
+            # Output plays in real time whatever rate frames were actually processed at
+            writer = TimedVideoWriter(path, cap.source_fps or 25.0, (w, h))
+            self.writers[cap.stream_name] = writer
+        writer.write(frame, frame_time)
+
+    def stop(self):
+        self.stop_event.set()
+        with self.new_frame:
+            self.new_frame.notify_all()
+
+
+# --------------------------
+# Entry Point
+# --------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless threaded face recognition runner")
+    parser.add_argument("sources", nargs="*", default=["0"],
+                        help="Capture sources: device index, video file, or stream URL (default: 0)")
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--det-size", type=int, default=640)
+    parser.add_argument("--known-faces", default=KNOWN_FACES_DIR)
+    parser.add_argument("--threshold", type=float, default=SIMILARITY_THRESHOLD)
+    parser.add_argument("--max-fps", type=float, default=None, help="Cap recognition rate per source")
+    parser.add_argument("--quality-gate", action="store_true", help="Skip embedding low-quality faces")
+    parser.add_argument("--output", default="-", help="JSON lines output file ('-' for stdout, '' to disable)")
+    parser.add_argument("--video-dir", default=None, help="Write annotated video per source into this directory")
+    parser.add_argument("--loop", action="store_true", help="Rewind video files when they end")
+    parser.add_argument("--display", action="store_true", help="Show annotated frames in a window")
+    args = parser.parse_args(argv)
+
+    app = load_model(args.model, (args.det_size, args.det_size))
+    gallery, names = load_known_faces(app, args.known_faces)
+
+    new_frame = threading.Condition()
+    try:
+        captures = [LatestFrameCapture(src, loop=args.loop, new_frame=new_frame) for src in args.sources]
+    except RuntimeError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    output = None
+    if args.output == "-":
+        output = sys.stdout
+    elif args.output:
+        output = open(args.output, "a")
+
+    worker = RecognitionWorker(app, gallery, names, captures, new_frame, threshold=args.threshold,
+                               max_fps=args.max_fps, quality_gate=FaceQualityGate() if args.quality_gate else None,
+                               output=output, video_dir=args.video_dir, display=args.display)
+
+    # Graceful shutdown on Ctrl+C / SIGTERM: stop capture, let the worker finish its frame, flush writers
+    def request_stop(signum, _frame):
+        print(f"Received signal {signum}, shutting down...", file=sys.stderr)
+        worker.stop()
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    for cap in captures:
+        cap.start()
+    worker.start()
+    print(f"Processing {len(captures)} source(s)...", file=sys.stderr)
+
+    try:
+        while worker.is_alive():
+            if args.display:
+                with worker.display_lock:
+                    frames = dict(worker.display_frames)
+                for name, frame in frames.items():
+                    cv2.imshow(f"Face Recognition - {name}", frame)
+                # Exit on 'q' key
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    worker.stop()
+            else:
+                worker.join(timeout=0.2)
+    finally:
+        worker.stop()
+        for cap in captures:
+            cap.stop()
+        worker.join(timeout=10.0)
+        for cap in captures:
+            cap.join(timeout=5.0)
+        if args.display:
+            cv2.destroyAllWindows()
+        if output is not None and output is not sys.stdout:
+            output.close()
+
+    for cap in captures:
+        print(f"{cap.stream_name}: read {cap.frames_read} frames, recognized {worker.processed[cap.stream_name]}",
+              file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,452 @@
+import sys
+import json
+import time
+import queue
+import pickle
+import argparse
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import av
+import cv2
+import numpy as np
+
+# --------------------------
+# Configuration
+# --------------------------
+EMBEDDINGS_CACHE_DIR = "embeddings_cache"
+FACE_DETECTION_SIZE = (320, 320)
+PROVIDERS = ['CUDAExecutionProvider', 'CPUExecutionProvider']
+# Processor defaults, matching test.py's sidebar
+PROCESS_EVERY_N_FRAMES = 2
+DOWNSCALE = 1.5
+MAX_PRELOAD_FRAMES = 300        # Frames decoded up front per video so decoding is not measured
+SAMPLE_INTERVAL = 10.0          # Seconds between metric samples
+WARMUP = 60.0                   # Seconds excluded from leak and cliff baselines
+
+# Default thresholds for automatic flags
+MAX_RSS_GROWTH_MB = 200.0       # Total RSS growth after warm-up
+MAX_RSS_SLOPE_MB_PER_HOUR = 50.0
+MIN_SLOPE_SPAN = 600.0          # Seconds of post-warm-up samples needed before the RSS trend is judged
+MAX_THREAD_GROWTH = 4
+MAX_P95_LATENCY_MS = 500.0
+MIN_THROUGHPUT_RATIO = 0.5      # A window below this fraction of the baseline throughput is a cliff
+MAX_ERROR_RATE = 0.01           # Fraction of handled frames allowed to raise
+
+
+def parse_duration(text: str) -> float:
+    """'90', '90s', '15m' or '2h' -> seconds."""
+    units = {"s": 1, "m": 60, "h": 3600}
+    if text and text[-1] in units:
+        return float(text[:-1]) * units[text[-1]]
+    return float(text)
+
+
+def read_rss_mb() -> float:
+    """Resident set size of this process in MB (Linux /proc, falling back to psutil)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024.0 * 1024.0)
+    except ImportError:
+        return float("nan")
+
+
+def read_os_threads() -> int:
+    """Native thread count, which includes onnxruntime/OpenCV pools Python cannot see."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("Threads:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return threading.active_count()
+
+
+def preload_frames(path: str, limit: int = MAX_PRELOAD_FRAMES):
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise RuntimeError(f"Could not open video {path!r}")
+    frames = []
+    while len(frames) < limit:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    if not frames:
+        raise RuntimeError(f"No frames decoded from {path!r}")
+    return frames
+
+
+# --------------------------
+# Processor Factories
+# --------------------------
+def load_gallery(app, model_name: str):
+    """Gallery from the embeddings cache written by test.py, else computed from known_faces."""
+    cache_path = Path(EMBEDDINGS_CACHE_DIR) / f"{model_name}_embeddings.pkl"
+    if cache_path.exists():
+        with open(cache_path, 'rb') as f:
+            cache_data = pickle.load(f)
+        return list(cache_data['embeddings']), list(cache_data['names'])
+    from baseline import load_known_faces
+    gallery, names = load_known_faces(app)
+    return list(gallery), names
+
+
+def make_processor_factory(kind: str, model_name: str, threshold: float,
+                           process_every_n: int = PROCESS_EVERY_N_FRAMES, downscale: float = DOWNSCALE,
+                           central_region: bool = False, quality_gate: bool = True, cluster_unknowns: bool = True,
+                           sightings_dir: Optional[str] = None, workers: int = 0,
+                           shards: Optional[str] = None) -> Callable[[str], Callable]:
+    """Return stream_id -> frame handler, built the same way the apps build them.
+
+    "processor" shares one FaceAnalysis, clusterer, sighting store, worker pool
+    and sharded gallery across streams like test.py's cached resources, with the
+    same options as its sidebar; "transformer" creates a models.py transformer
+    (and so a model copy) per stream, like one app.py browser session each.
+    The returned factory has a `close()` that shuts the shared resources down.
+    """
+    from quality import FaceQualityGate
+
+    if kind == "processor":
+        from insightface.app import FaceAnalysis
+        from processor import FaceRecognitionProcessor
+
+        app = FaceAnalysis(name=model_name, providers=PROVIDERS)
+        app.prepare(ctx_id=0, det_size=FACE_DETECTION_SIZE)
+        known_embeddings, known_names = load_gallery(app, model_name)
+
+        clusterer = store = pool = gallery = None
+        if cluster_unknowns:
+            from unknown_clusters import UnknownFaceClusterer
+            clusterer = UnknownFaceClusterer()
+        if sightings_dir:
+            from sightings import SightingStore
+            store = SightingStore(sightings_dir)
+        if workers:
+            from worker_pool import InferenceWorkerPool, InsightFaceRecognizer
+            recognizer = InsightFaceRecognizer(model_name, FACE_DETECTION_SIZE, PROVIDERS,
+                                               quality_gate=FaceQualityGate() if quality_gate else None)
+            pool = InferenceWorkerPool(num_workers=workers, recognizer=recognizer)
+        if shards:
+            from sharded_gallery import ShardedGallery
+            gallery = ShardedGallery([a.strip() for a in shards.split(",") if a.strip()])
+
+        def factory(stream_id: str):
+            proc = FaceRecognitionProcessor(
+                face_app=app,
+                known_embeddings=known_embeddings,
+                known_names=known_names,
+                similarity_threshold=threshold,
+                result_queue=queue.Queue(maxsize=10),
+                process_every_n=process_every_n,
+                downscale=downscale,
+                use_central_region=central_region,
+                sighting_store=store,
+                stream_id=stream_id,
+                unknown_clusterer=clusterer,
+                worker_pool=pool,
+                quality_gate=FaceQualityGate() if quality_gate and pool is None else None,
+                sharded_gallery=gallery,
+            )
+            return proc.process_frame
+
+        def close():
+            for resource in (pool, store, gallery):
+                if resource is not None:
+                    resource.close()
+        factory.close = close
+        return factory
+
+    if kind in ("transformer", "transformer-small"):
+        from models import FaceRecognitionTransformer, SmallFaceRecognitionTransformer
+
+        cls = FaceRecognitionTransformer if kind == "transformer" else SmallFaceRecognitionTransformer
+
+        def factory(stream_id: str):
+            return cls(quality_gate=FaceQualityGate() if quality_gate else None).transform
+        factory.close = lambda: None
+        return factory
+
+    raise ValueError(f"Unknown processor kind {kind!r}")
+
+
+# --------------------------
+# Synthetic Streams
+# --------------------------
+class SyntheticStream(threading.Thread):
+    """Replays preloaded frames into a handler at a fixed frame rate.
+
+    Like a live WebRTC track, frames keep arriving on schedule; if the handler
+    overruns, the frames whose slots passed are counted as dropped, not queued.
+    """
+
+    def __init__(self, stream_id: str, frames: list, fps: float, handler: Callable, stop_event: threading.Event):
+        super().__init__(name=f"stream-{stream_id}", daemon=True)
+        self.stream_id = stream_id
+        self.frames = frames
+        self.period = 1.0 / fps
+        self.handler = handler
+        self.stop_event = stop_event
+        self.lock = threading.Lock()
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.last_error = None
+        self._latencies: List[float] = []   # Since the last sample
+
+    def run(self):
+        next_t = time.monotonic()
+        i = 0
+        while not self.stop_event.is_set():
+            now = time.monotonic()
+            if now < next_t:
+                self.stop_event.wait(next_t - now)
+                continue
+            # Skip every slot that went by while the handler was busy
+            missed = int((now - next_t) / self.period)
+            if missed:
+                with self.lock:
+                    self.dropped += missed
+                i += missed
+                next_t += missed * self.period
+
+            frame = av.VideoFrame.from_ndarray(self.frames[i % len(self.frames)], format="bgr24")
+            start = time.perf_counter()
+            try:
+                self.handler(frame)
+                latency = (time.perf_counter() - start) * 1000.0
+                with self.lock:
+                    self.processed += 1
+                    self._latencies.append(latency)
+            except Exception as e:
+                with self.lock:
+                    self.errors += 1
+                    self.last_error = repr(e)
+            i += 1
+            next_t += self.period
+
+    def take_window(self) -> Dict[str, float]:
+        with self.lock:
+            latencies, self._latencies = self._latencies, []
+            return {"processed": self.processed, "dropped": self.dropped, "errors": self.errors,
+                    "latencies": latencies}
+
+
+# --------------------------
+# Analysis
+# --------------------------
+def analyze(samples: List[Dict], warmup: float = WARMUP, max_rss_growth_mb: float = MAX_RSS_GROWTH_MB,
+            max_rss_slope: float = MAX_RSS_SLOPE_MB_PER_HOUR, max_thread_growth: int = MAX_THREAD_GROWTH,
+            max_p95_latency_ms: float = MAX_P95_LATENCY_MS,
+            min_throughput_ratio: float = MIN_THROUGHPUT_RATIO, min_slope_span: float = MIN_SLOPE_SPAN,
+            max_error_rate: float = MAX_ERROR_RATE) -> List[str]:
+    """Flag handler errors, leaks, thread growth, latency blow-ups and throughput cliffs in a sample series."""
+    flags = []
+    # Errors count from the first frame; a handler that always raises has no throughput to compare
+    errors = sum(s["errors"] for s in samples)
+    handled = errors + sum(s["processed"] for s in samples)
+    if handled and errors / handled > max_error_rate:
+        flags.append(f"Handler raised on {errors} of {handled} frames "
+                     f"({100.0 * errors / handled:.1f}%, limit {100.0 * max_error_rate:.1f}%)")
+
+    steady = [s for s in samples if s["elapsed"] >= warmup]
+    if len(steady) < 2:
+        return flags
+
+    t = np.array([s["elapsed"] for s in steady]) / 3600.0
+    rss = np.array([s["rss_mb"] for s in steady])
+    growth = rss[-1] - rss[0]
+    if growth > max_rss_growth_mb:
+        flags.append(f"RSS grew {growth:.0f} MB after warm-up (limit {max_rss_growth_mb:.0f} MB)")
+    # A short window turns allocator jitter into a huge per-hour slope, so only judge long ones
+    if len(steady) >= 3 and (t[-1] - t[0]) * 3600.0 >= min_slope_span:
+        slope = np.polyfit(t, rss, 1)[0]
+        if slope > max_rss_slope:
+            flags.append(f"RSS trending up {slope:.1f} MB/hour (limit {max_rss_slope:.1f} MB/hour)")
+
+    threads = [s["os_threads"] for s in steady]
+    if max(threads) - threads[0] > max_thread_growth:
+        flags.append(f"Thread count grew from {threads[0]} to {max(threads)} (limit +{max_thread_growth})")
+
+    for s in steady:
+        if s["p95_ms"] is not None and s["p95_ms"] > max_p95_latency_ms:
+            flags.append(f"p95 latency {s['p95_ms']:.0f} ms at {s['elapsed']:.0f}s "
+                         f"(limit {max_p95_latency_ms:.0f} ms)")
+            break
+
+    baseline = float(np.median([s["fps"] for s in steady[:3]]))
+    if baseline > 0:
+        for s in steady[3:]:
+            if s["fps"] < min_throughput_ratio * baseline:
+                flags.append(f"Throughput cliff at {s['elapsed']:.0f}s: {s['fps']:.1f} fps "
+                             f"vs baseline {baseline:.1f} fps")
+                break
+    return flags
+
+
+# --------------------------
+# Runner
+# --------------------------
+def run(videos: List[str], streams: int, fps: float, duration: float, factory: Callable[[str], Callable],
+        sample_interval: float = SAMPLE_INTERVAL, report=None, thresholds: Optional[Dict] = None,
+        fail_fast: bool = False) -> Dict:
+    frame_sets = [preload_frames(v) for v in videos]
+    stop_event = threading.Event()
+    workers = []
+    for n in range(streams):
+        stream_id = f"stream-{n}"
+        handler = factory(stream_id)
+        workers.append(SyntheticStream(stream_id, frame_sets[n % len(frame_sets)], fps, handler, stop_event))
+
+    samples = []
+    flags = []
+    start = time.monotonic()
+    prev = {w.stream_id: {"processed": 0, "dropped": 0, "errors": 0} for w in workers}
+    for w in workers:
+        w.start()
+    try:
+        next_sample = start + sample_interval
+        while time.monotonic() - start < duration:
+            time.sleep(max(0.0, min(next_sample, start + duration) - time.monotonic()))
+            now = time.monotonic()
+            window = now - (next_sample - sample_interval)
+            next_sample = now + sample_interval
+
+            per_stream = {}
+            all_latencies = []
+            for w in workers:
+                # Drain result queues the way the dashboard would
+                result_queue = getattr(getattr(w.handler, "__self__", None), "result_queue", None)
+                while result_queue is not None:
+                    try:
+                        result_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                win = w.take_window()
+                lat = win.pop("latencies")
+                all_latencies.extend(lat)
+                per_stream[w.stream_id] = {
+                    "fps": (win["processed"] - prev[w.stream_id]["processed"]) / window,
+                    "processed": win["processed"] - prev[w.stream_id]["processed"],
+                    "dropped": win["dropped"] - prev[w.stream_id]["dropped"],
+                    "errors": win["errors"] - prev[w.stream_id]["errors"],
+                    "p95_ms": float(np.percentile(lat, 95)) if lat else None,
+                }
+                prev[w.stream_id] = win
+
+            sample = {
+                "elapsed": round(now - start, 1),
+                "rss_mb": round(read_rss_mb(), 1),
+                "py_threads": threading.active_count(),
+                "os_threads": read_os_threads(),
+                "fps": sum(s["fps"] for s in per_stream.values()),
+                "processed": sum(s["processed"] for s in per_stream.values()),
+                "dropped": sum(s["dropped"] for s in per_stream.values()),
+                "errors": sum(s["errors"] for s in per_stream.values()),
+                "p50_ms": float(np.percentile(all_latencies, 50)) if all_latencies else None,
+                "p95_ms": float(np.percentile(all_latencies, 95)) if all_latencies else None,
+                "streams": per_stream,
+            }
+            samples.append(sample)
+            if report is not None:
+                report.write(json.dumps(sample) + "\n")
+                report.flush()
+            p95 = f"{sample['p95_ms']:.0f}" if sample["p95_ms"] is not None else "-"
+            print(f"[{sample['elapsed']:>8.0f}s] fps={sample['fps']:6.1f} dropped={sample['dropped']:5d} "
+                  f"p95={p95:>5}ms rss={sample['rss_mb']:7.1f}MB threads={sample['os_threads']}",
+                  file=sys.stderr)
+
+            flags = analyze(samples, **(thresholds or {}))
+            if flags and fail_fast:
+                break
+    finally:
+        stop_event.set()
+        for w in workers:
+            w.join(timeout=5.0)
+
+    errors = {w.stream_id: w.last_error for w in workers if w.errors}
+    return {"samples": samples, "flags": analyze(samples, **(thresholds or {})), "errors": errors}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Soak/load test the face recognition processors with synthetic streams")
+    parser.add_argument("videos", nargs="+", help="Local video files; streams cycle through them")
+    parser.add_argument("--streams", type=int, default=4)
+    parser.add_argument("--fps", type=float, default=15.0, help="Frame rate per stream")
+    parser.add_argument("--duration", default="10m", help="e.g. 600, 30m, 4h")
+    parser.add_argument("--processor", choices=["processor", "transformer", "transformer-small"], default="processor")
+    parser.add_argument("--model", default="buffalo_s", help="Model pack for --processor processor")
+    parser.add_argument("--threshold", type=float, default=0.3)
+    # Mirrors test.py's sidebar so the configuration the app runs can be soaked
+    parser.add_argument("--process-every-n", type=int, default=PROCESS_EVERY_N_FRAMES)
+    parser.add_argument("--downscale", type=float, default=DOWNSCALE)
+    parser.add_argument("--central-region", action="store_true", help="Process only the central region")
+    parser.add_argument("--quality-gate", action=argparse.BooleanOptionalAction, default=True,
+                        help="Skip low-quality faces before embedding")
+    parser.add_argument("--cluster-unknowns", action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument("--sightings-dir", default=None, help="Record sightings here (off by default)")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Inference worker processes (their memory is not in the RSS samples)")
+    parser.add_argument("--shards", default=None, help="Comma-separated gallery shard addresses")
+    parser.add_argument("--sample-interval", type=float, default=SAMPLE_INTERVAL)
+    parser.add_argument("--report", default=None, help="Write one JSON line per sample here")
+    parser.add_argument("--fail-fast", action="store_true", help="Stop as soon as anything is flagged")
+    parser.add_argument("--warmup", type=float, default=WARMUP)
+    parser.add_argument("--max-rss-growth-mb", type=float, default=MAX_RSS_GROWTH_MB)
+    parser.add_argument("--max-rss-slope", type=float, default=MAX_RSS_SLOPE_MB_PER_HOUR, help="MB per hour")
+    parser.add_argument("--min-slope-span", type=float, default=MIN_SLOPE_SPAN,
+                        help="Seconds after warm-up before the RSS slope is checked")
+    parser.add_argument("--max-thread-growth", type=int, default=MAX_THREAD_GROWTH)
+    parser.add_argument("--max-p95-latency-ms", type=float, default=MAX_P95_LATENCY_MS)
+    parser.add_argument("--min-throughput-ratio", type=float, default=MIN_THROUGHPUT_RATIO)
+    parser.add_argument("--max-error-rate", type=float, default=MAX_ERROR_RATE)
+    args = parser.parse_args(argv)
+
+    thresholds = {
+        "warmup": args.warmup,
+        "max_rss_growth_mb": args.max_rss_growth_mb,
+        "max_rss_slope": args.max_rss_slope,
+        "max_thread_growth": args.max_thread_growth,
+        "max_p95_latency_ms": args.max_p95_latency_ms,
+        "min_throughput_ratio": args.min_throughput_ratio,
+        "min_slope_span": args.min_slope_span,
+        "max_error_rate": args.max_error_rate,
+    }
+    factory = make_processor_factory(args.processor, args.model, args.threshold,
+                                     process_every_n=args.process_every_n, downscale=args.downscale,
+                                     central_region=args.central_region, quality_gate=args.quality_gate,
+                                     cluster_unknowns=args.cluster_unknowns, sightings_dir=args.sightings_dir,
+                                     workers=args.workers, shards=args.shards)
+    report = open(args.report, "w") if args.report else None
+    try:
+        result = run(args.videos, args.streams, args.fps, parse_duration(args.duration), factory,
+                     sample_interval=args.sample_interval, report=report, thresholds=thresholds,
+                     fail_fast=args.fail_fast)
+    finally:
+        factory.close()
+        if report is not None:
+            report.close()
+
+    for stream_id, error in result["errors"].items():
+        print(f"{stream_id}: handler raised {error}", file=sys.stderr)
+    if result["flags"]:
+        print("FLAGGED:", file=sys.stderr)
+        for flag in result["flags"]:
+            print(f"  - {flag}", file=sys.stderr)
+        return 1
+    print("No errors, leaks or throughput cliffs detected.", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,18 +1,21 @@
 import os
 import cv2
 import numpy as np
+from typing import Optional
 from insightface.app import FaceAnalysis
 from streamlit_webrtc import webrtc_streamer, VideoTransformerBase
+from quality import FaceQualityGate
 
 # Configuration
 KNOWN_FACES_DIR = "known_faces"
 MODEL_NAME = "buffalo_l"
 SMALL_MODEL_NAME = "buffalo_s"
 PROVIDERS = ['CUDAExecutionProvider', 'CPUExecutionProvider']
+LOW_QUALITY_COLOR = (128, 128, 128)
 
 
 class SmallFaceRecognitionTransformer(VideoTransformerBase):
-    def __init__(self):
+    def __init__(self, quality_gate: Optional[FaceQualityGate] = None):
         super().__init__()
         # Initialize face analysis model
         self.app = FaceAnalysis(name=SMALL_MODEL_NAME, providers=PROVIDERS)
@@ -20,6 +23,8 @@ class SmallFaceRecognitionTransformer(VideoTransformerBase):
         
         # Load and process known faces
         self.known_embeddings, self.known_names = self._load_known_faces()
+        # When set, skip recognition on tiny, blurred, turned or low-confidence faces
+        self.quality_gate = quality_gate
     
     def _load_known_faces(self):
         known_embeddings = []
@@ -74,13 +79,17 @@ class SmallFaceRecognitionTransformer(VideoTransformerBase):
     def transform(self, frame):
         img = frame.to_ndarray(format="bgr24")
         
-        # Perform face detection
-        faces = self.app.get(img)
+        # Perform face detection; with a quality gate only faces passing it are embedded
+        faces = self.quality_gate.get(self.app, img) if self.quality_gate else self.app.get(img)
         
         for face in faces:
             bbox = face.bbox.astype(int)
             x1, y1, x2, y2 = bbox[0], bbox[1], bbox[2], bbox[3]
             
+            if face.embedding is None:
+                cv2.rectangle(img, (x1, y1), (x2, y2), LOW_QUALITY_COLOR, 1)
+                continue
+            
             # Get embedding
             emb = face.normed_embedding if hasattr(face, 'normed_embedding') else face.embedding
             emb = emb.flatten()
@@ -112,7 +121,7 @@ class SmallFaceRecognitionTransformer(VideoTransformerBase):
 
 
 class FaceRecognitionTransformer(VideoTransformerBase):
-    def __init__(self):
+    def __init__(self, quality_gate: Optional[FaceQualityGate] = None):
         super().__init__()
         # Initialize face analysis model
         self.app = FaceAnalysis(name=MODEL_NAME, providers=PROVIDERS)
@@ -120,6 +129,8 @@ class FaceRecognitionTransformer(VideoTransformerBase):
         
         # Load and process known faces
         self.known_embeddings, self.known_names = self._load_known_faces()
+        # When set, skip recognition on tiny, blurred, turned or low-confidence faces
+        self.quality_gate = quality_gate
     
     def _load_known_faces(self):
         known_embeddings = []
@@ -174,13 +185,17 @@ class FaceRecognitionTransformer(VideoTransformerBase):
     def transform(self, frame):
         img = frame.to_ndarray(format="bgr24")
         
-        # Perform face detection
-        faces = self.app.get(img)
+        # Perform face detection; with a quality gate only faces passing it are embedded
+        faces = self.quality_gate.get(self.app, img) if self.quality_gate else self.app.get(img)
         
         for face in faces:
             bbox = face.bbox.astype(int)
             x1, y1, x2, y2 = bbox[0], bbox[1], bbox[2], bbox[3]
             
+            if face.embedding is None:
+                cv2.rectangle(img, (x1, y1), (x2, y2), LOW_QUALITY_COLOR, 1)
+                continue
+            
             # Get embedding
             emb = face.normed_embedding if hasattr(face, 'normed_embedding') else face.embedding
             emb = emb.flatten()
@@ -0,0 +1,197 @@
+import time
+import queue
+import uuid
+from types import SimpleNamespace
+from typing import Tuple
+
+import av
+import cv2
+import numpy as np
+
+from sightings import SightingStore
+from unknown_clusters import UnknownFaceClusterer, is_unknown, cluster_id
+from worker_pool import InferenceWorkerPool
+from quality import FaceQualityGate
+from sharded_gallery import ShardedGallery
+
+LOW_QUALITY = "Low quality"  # Label for faces rejected by the quality gate (never embedded)
+
+
+# --------------------------
+# Optimized Processor Class
+# --------------------------
+class FaceRecognitionProcessor:
+    def __init__(self, face_app, known_embeddings, known_names, similarity_threshold: float, 
+                result_queue: queue.Queue, process_every_n: int, downscale: float,
+                use_central_region: bool, sighting_store: SightingStore = None,
+                stream_id: str = "default", unknown_clusterer: UnknownFaceClusterer = None,
+                worker_pool: InferenceWorkerPool = None, quality_gate: FaceQualityGate = None,
+                sharded_gallery: ShardedGallery = None):
+        self.face_app = face_app
+        self.known_embeddings = known_embeddings
+        self.known_names = known_names
+        self.similarity_threshold = similarity_threshold
+        self.result_queue = result_queue
+        self.process_every_n = process_every_n
+        self.downscale = downscale
+        self.use_central_region = use_central_region
+        self.sighting_store = sighting_store
+        self.stream_id = stream_id
+        self.unknown_clusterer = unknown_clusterer
+        self.worker_pool = worker_pool
+        # Pools are shared across sessions, so results are routed by a tag unique to this processor
+        self.pool_tag = f"{stream_id}-{uuid.uuid4()}"
+        self.annotations = []  # (bbox, label, similarity) of the last fresh result, redrawn until the next
+        self.quality_gate = quality_gate
+        self.sharded_gallery = sharded_gallery  # When set, replaces the local known_embeddings
+        self.recognitions_saved = 0  # Faces the quality gate kept away from the recognition model
+        self.frame_count = 0
+        self.prev_time = None  # For FPS calculation
+        self.recent_fps = []  # Track recent FPS values for smoothing
+
+    def detect_faces(self, img: np.ndarray) -> Tuple[list, bool]:
+        """Detected faces and whether they are a new result (False: nothing new from the pool)."""
+        if self.worker_pool is None:
+            if self.quality_gate is not None:
+                return self.quality_gate.get(self.face_app, img), True
+            return self.face_app.get(img), True
+        # Hand the frame to the pool and use the newest finished result for this stream.
+        # Results lag by about one processed frame but inference no longer holds our GIL.
+        self.worker_pool.submit(img, tag=self.pool_tag)
+        faces = self.worker_pool.latest(self.pool_tag)
+        if faces is None:
+            return [], False
+        return [SimpleNamespace(**face) for face in faces], True
+
+    def process_frame(self, frame: av.VideoFrame) -> av.VideoFrame:
+        # Increment frame counter
+        self.frame_count += 1
+        
+        # Convert frame to a BGR image (numpy array)
+        img = frame.to_ndarray(format="bgr24")
+        h, w = img.shape[:2]
+        detections = []  # To store detected face info
+        
+        # Measure time for FPS calculation
+        current_time = time.time()
+        fps = 0.0
+        if self.prev_time is not None:
+            dt = current_time - self.prev_time
+            if dt > 0:
+                fps = 1.0 / dt
+                self.recent_fps.append(fps)
+                if len(self.recent_fps) > 5:  # Keep only recent 5 values
+                    self.recent_fps.pop(0)
+        self.prev_time = current_time
+        
+        # Only process every Nth frame to improve performance
+        if self.frame_count % self.process_every_n == 0:
+            # Downscale image for faster processing
+            if self.downscale > 1.0:
+                proc_img = cv2.resize(img, (int(w/self.downscale), int(h/self.downscale)))
+            else:
+                proc_img = img
+            
+            # Process only central region if enabled
+            if self.use_central_region:
+                ph, pw = proc_img.shape[:2]
+                # Extract center region (60% of image)
+                margin_h, margin_w = int(ph * 0.2), int(pw * 0.2)
+                central_img = proc_img[margin_h:ph-margin_h, margin_w:pw-margin_w]
+                faces, fresh = self.detect_faces(central_img)
+                # Adjust bounding box coordinates to original image space
+                scale_h, scale_w = h / (ph - 2*margin_h), w / (pw - 2*margin_w)
+                
+                for face in faces:
+                    bbox = face.bbox.astype(int)
+                    # Adjust coordinates to full image space
+                    bbox[0] = int(bbox[0] * scale_w + margin_w * (w / pw))
+                    bbox[1] = int(bbox[1] * scale_h + margin_h * (h / ph))
+                    bbox[2] = int(bbox[2] * scale_w + margin_w * (w / pw))
+                    bbox[3] = int(bbox[3] * scale_h + margin_h * (h / ph))
+                    face.bbox = bbox
+            else:
+                # Process the entire image
+                faces, fresh = self.detect_faces(proc_img)
+                # Adjust bounding boxes if downscaling was applied
+                if self.downscale > 1.0:
+                    for face in faces:
+                        face.bbox = face.bbox * self.downscale
+            
+            # Only a new result is matched, clustered, recorded and counted; a stale
+            # frame just redraws the previous annotations
+            if fresh:
+                # Match detected faces against the gallery
+                matches = []
+                for face in faces:
+                    bbox = face.bbox.astype(int)
+                    x1, y1, x2, y2 = max(0, bbox[0]), max(0, bbox[1]), min(w-1, bbox[2]), min(h-1, bbox[3])
+                
+                    # Get embedding
+                    emb = face.normed_embedding if hasattr(face, "normed_embedding") else face.embedding
+                    if emb is None:
+                        # Rejected by the quality gate: draw it, but never match it
+                        self.recognitions_saved += 1
+                        matches.append([(x1, y1, x2, y2), LOW_QUALITY, -1.0, None])
+                        continue
+                    emb = emb.flatten()
+                
+                    # Compare to known faces
+                    identity = "Unknown"
+                    best_sim = -1.0
+                    if self.known_embeddings and self.sharded_gallery is None:
+                        # Vectorized comparison for speed
+                        similarities = np.dot(self.known_embeddings, emb)
+                        if len(similarities) > 0:
+                            best_idx = np.argmax(similarities)
+                            best_sim = similarities[best_idx]
+                            identity = self.known_names[best_idx] if best_sim >= self.similarity_threshold else "Unknown"
+                    matches.append([(x1, y1, x2, y2), identity, best_sim, emb])
+            
+                # One scatter-gather round trip for every embedded face in this frame
+                gallery_down = False  # No shard answered, so "Unknown" is not a real verdict
+                if self.sharded_gallery is not None:
+                    embedded = [m for m in matches if m[3] is not None]
+                    if embedded:
+                        found = self.sharded_gallery.search(np.stack([m[3] for m in embedded]), k=1,
+                                                            similarity_threshold=self.similarity_threshold)
+                        gallery_down = len(found["missing_shards"]) >= found["shards"]
+                        for m, identity, best_sim in zip(embedded, found["identities"], found["best_scores"]):
+                            m[1], m[2] = identity, float(best_sim)
+            
+                # Group all unknown faces of this frame in one batched call
+                if self.unknown_clusterer is not None and not gallery_down:
+                    unknown = [m for m in matches if m[1] == "Unknown"]
+                    if unknown:
+                        labels = self.unknown_clusterer.assign(np.stack([m[3] for m in unknown]))
+                        for m, label in zip(unknown, labels):
+                            m[1] = label
+            
+                for (x1, y1, x2, y2), identity, best_sim, emb in matches:
+                    if self.sighting_store is not None and emb is not None and not gallery_down:
+                        # Non-blocking: the store batches writes on its own thread. Cluster labels
+                        # are never reused, so they go in their own column rather than the identity.
+                        recorded = "Unknown" if is_unknown(identity) else identity
+                        self.sighting_store.append(current_time, self.stream_id, recorded,
+                                                   best_sim, (x1, y1, x2, y2), emb, cluster=cluster_id(identity))
+                self.annotations = [(bbox, identity, best_sim) for bbox, identity, best_sim, _ in matches]
+
+            for (x1, y1, x2, y2), identity, best_sim in self.annotations:
+                # Draw bounding box and label on the image
+                if identity == LOW_QUALITY:
+                    color = (128, 128, 128)
+                else:
+                    color = (0, 0, 255) if is_unknown(identity) else (0, 255, 0)
+                cv2.rectangle(img, (x1, y1), (x2, y2), color, 2)
+                cv2.putText(img, identity, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2)
+                detections.append({"Face": identity, "Similarity": round(best_sim, 2)})
+            
+        # Package results (FPS and detections) into a dictionary and push to the result queue
+        result = {"fps": np.mean(self.recent_fps) if self.recent_fps else fps, "detections": detections,
+                  "recognitions_saved": self.recognitions_saved}
+        try:
+            self.result_queue.put_nowait(result)  # Non-blocking put
+        except queue.Full:
+            pass  # Skip if queue is full
+        
+        return av.VideoFrame.from_ndarray(img, format="bgr24")
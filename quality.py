@@ -0,0 +1,225 @@
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# --------------------------
+# Configuration
+# --------------------------
+MIN_DET_SCORE = 0.6     # Detector confidence
+MIN_FACE_SIZE = 40      # Shorter bbox side, in pixels of the image given to the detector
+MAX_YAW = 45.0          # Degrees, estimated from the 5 landmarks
+MAX_PITCH = 35.0        # Degrees, estimated from the 5 landmarks
+MIN_SHARPNESS = 30.0    # Variance of the Laplacian on a 64x64 grayscale crop
+SHARPNESS_SIZE = 64
+
+
+def estimate_pose(kps: np.ndarray) -> Tuple[float, float, float]:
+    """Rough (yaw, pitch, roll) in degrees from InsightFace's 5 landmarks.
+
+    Landmarks are left eye, right eye, nose, left mouth corner, right mouth corner.
+    Yaw comes from how far the nose sits from the eye midpoint relative to half the
+    eye distance, pitch from where the nose sits between the eye and mouth lines.
+    """
+    kps = np.asarray(kps, dtype=np.float32).reshape(5, 2)
+    left_eye, right_eye, nose, left_mouth, right_mouth = kps
+    eye_vec = right_eye - left_eye
+    roll = np.degrees(np.arctan2(eye_vec[1], eye_vec[0]))
+
+    # Undo roll so the eye line is horizontal
+    c, s = np.cos(np.radians(-roll)), np.sin(np.radians(-roll))
+    rot = np.array([[c, -s], [s, c]], dtype=np.float32)
+    eye_mid = (left_eye + right_eye) / 2
+    pts = (kps - eye_mid) @ rot.T
+    half_eye = max(np.linalg.norm(eye_vec) / 2, 1e-6)
+    nose_x, nose_y = pts[2]
+    mouth_y = (pts[3, 1] + pts[4, 1]) / 2
+
+    yaw = np.degrees(np.arcsin(np.clip(nose_x / half_eye, -1.0, 1.0)))
+    # On a frontal face the nose tip sits about halfway down from the eye line to the mouth
+    ratio = nose_y / mouth_y if mouth_y > 1e-6 else 0.0
+    pitch = np.degrees(np.arcsin(np.clip((ratio - 0.5) * 2.0, -1.0, 1.0)))
+    return float(yaw), float(pitch), float(roll)
+
+
+def sharpness(img: np.ndarray, bbox) -> float:
+    """Variance of the Laplacian over the face crop, resized so the score is scale-independent."""
+    h, w = img.shape[:2]
+    x1, y1, x2, y2 = [int(v) for v in bbox[:4]]
+    x1, y1, x2, y2 = max(0, x1), max(0, y1), min(w, x2), min(h, y2)
+    if x2 - x1 < 2 or y2 - y1 < 2:
+        return 0.0
+    crop = img[y1:y2, x1:x2]
+    if crop.ndim == 3:
+        crop = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+    crop = cv2.resize(crop, (SHARPNESS_SIZE, SHARPNESS_SIZE), interpolation=cv2.INTER_AREA)
+    return float(cv2.Laplacian(crop, cv2.CV_32F).var())
+
+
+class FaceQualityGate:
+    """Rejects poor detections before the recognition model runs.
+
+    `get` is a drop-in replacement for `FaceAnalysis.get`: it runs the detector,
+    checks each face, and only runs the other models (recognition etc.) on faces
+    that pass. Rejected faces are still returned with `embedding` left as None and
+    `quality` set to the reason, so callers can draw or track them.
+    """
+
+    def __init__(self, min_det_score: float = MIN_DET_SCORE, min_face_size: float = MIN_FACE_SIZE,
+                 max_yaw: float = MAX_YAW, max_pitch: float = MAX_PITCH, min_sharpness: float = MIN_SHARPNESS):
+        self.min_det_score = min_det_score
+        self.min_face_size = min_face_size
+        self.max_yaw = max_yaw
+        self.max_pitch = max_pitch
+        self.min_sharpness = min_sharpness
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def __getstate__(self):
+        # Picklable so the gate can travel to worker processes with a recognizer
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def reset_stats(self):
+        self.checked = 0
+        self.rejected = {"det_score": 0, "size": 0, "pose": 0, "blur": 0}
+
+    def check(self, img: np.ndarray, bbox, kps, det_score: float) -> Optional[str]:
+        """Return None if the face is good enough to embed, else the rejection reason.
+
+        Checks run cheapest first so most rejections never compute sharpness.
+        """
+        if det_score < self.min_det_score:
+            return "det_score"
+        if min(bbox[2] - bbox[0], bbox[3] - bbox[1]) < self.min_face_size:
+            return "size"
+        if kps is not None:
+            yaw, pitch, _ = estimate_pose(kps)
+            if abs(yaw) > self.max_yaw or abs(pitch) > self.max_pitch:
+                return "pose"
+        if sharpness(img, bbox) < self.min_sharpness:
+            return "blur"
+        return None
+
+    def get(self, app, img: np.ndarray, max_num: int = 0) -> list:
+        from insightface.app.common import Face
+
+        bboxes, kpss = app.det_model.detect(img, max_num=max_num, metric='default')
+        faces = []
+        reasons = []
+        for i in range(bboxes.shape[0]):
+            kps = kpss[i] if kpss is not None else None
+            face = Face(bbox=bboxes[i, 0:4], kps=kps, det_score=bboxes[i, 4])
+            reason = self.check(img, face.bbox, kps, face.det_score)
+            face.quality = reason or "ok"
+            if reason is None:
+                for taskname, model in app.models.items():
+                    if taskname == 'detection':
+                        continue
+                    model.get(img, face)
+            faces.append(face)
+            reasons.append(reason)
+        self._record(reasons)
+        return faces
+
+    def _record(self, reasons: List[Optional[str]]):
+        with self._lock:
+            self.checked += len(reasons)
+            for reason in reasons:
+                if reason is not None:
+                    self.rejected[reason] += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            saved = sum(self.rejected.values())
+            return {"checked": self.checked, "recognitions_saved": saved,
+                    **{f"rejected_{k}": v for k, v in self.rejected.items()}}
+
+
+# --------------------------
+# Offline Evaluation
+# --------------------------
+def _degrade(img: np.ndarray) -> Dict[str, np.ndarray]:
+    """Variants of a clean enrolment photo that mimic poor CCTV captures."""
+    h, w = img.shape[:2]
+    tiny = cv2.resize(img, (max(1, w // 8), max(1, h // 8)), interpolation=cv2.INTER_AREA)
+    return {
+        "original": img,
+        "blurred": cv2.GaussianBlur(img, (0, 0), 6),
+        "tiny": cv2.copyMakeBorder(tiny, h // 3, h // 3, w // 3, w // 3, cv2.BORDER_CONSTANT),
+        "dark_noisy": np.clip(img * 0.25 + np.random.default_rng(0).normal(0, 20, img.shape), 0, 255).astype(np.uint8),
+    }
+
+
+def evaluate(app, directory: str, gate: FaceQualityGate, similarity_threshold: float = 0.3) -> Dict[str, float]:
+    """Leave-one-out matching over `directory`, with and without the gate.
+
+    Every image (and degraded copies of it) is matched against a gallery built
+    from the *other* images, so a "false match" is a face that clears the
+    threshold but is assigned someone else's name.
+    """
+    samples = []  # (filename, true name, variant, embedding, rejection reason)
+    for filename in sorted(os.listdir(directory)):
+        if not filename.lower().endswith(('.jpg', '.jpeg', '.png')):
+            continue
+        img = cv2.imread(os.path.join(directory, filename))
+        if img is None:
+            continue
+        name = filename.split('_')[0]
+        for variant, vimg in _degrade(img).items():
+            faces = app.get(vimg)
+            if not faces:
+                continue
+            face = faces[0]
+            reason = gate.check(vimg, face.bbox, face.kps, face.det_score)
+            samples.append((filename, name, variant, face.normed_embedding, reason))
+
+    clean = [s for s in samples if s[2] == "original"]
+    counts = {"faces": 0, "false_matches": 0, "gated_faces": 0, "gated_false_matches": 0}
+    for filename, name, _, emb, reason in samples:
+        gallery = {}
+        for other_file, other_name, _, other_emb, _ in clean:
+            if other_file != filename:
+                gallery.setdefault(other_name, []).append(other_emb)
+        if not gallery:
+            continue
+        names = list(gallery)
+        means = np.stack([np.mean(gallery[n], axis=0) for n in names])
+        means /= np.linalg.norm(means, axis=1, keepdims=True)
+        sims = means @ emb
+        best = int(np.argmax(sims))
+        false_match = sims[best] >= similarity_threshold and names[best] != name
+
+        counts["faces"] += 1
+        counts["false_matches"] += int(false_match)
+        if reason is None:
+            counts["gated_faces"] += 1
+            counts["gated_false_matches"] += int(false_match)
+
+    counts["recognitions_saved"] = counts["faces"] - counts["gated_faces"]
+    counts["false_match_rate"] = counts["false_matches"] / max(counts["faces"], 1)
+    counts["gated_false_match_rate"] = counts["gated_false_matches"] / max(counts["gated_faces"], 1)
+    return counts
+
+
+if __name__ == "__main__":
+    import argparse
+    from insightface.app import FaceAnalysis
+
+    parser = argparse.ArgumentParser(description="Measure the quality gate's effect on known_faces")
+    parser.add_argument("--model", default="buffalo_s")
+    parser.add_argument("--dir", default="known_faces")
+    parser.add_argument("--threshold", type=float, default=0.3)
+    args = parser.parse_args()
+
+    app = FaceAnalysis(name=args.model, providers=['CUDAExecutionProvider', 'CPUExecutionProvider'])
+    app.prepare(ctx_id=0, det_size=(640, 640))
+    for key, value in evaluate(app, args.dir, FaceQualityGate(), args.threshold).items():
+        print(f"{key:>24}: {value:.3f}" if isinstance(value, float) else f"{key:>24}: {value}")
@@ -0,0 +1,590 @@
+import os
+import sys
+import time
+import pickle
+import socket
+import bisect
+import hashlib
+import ipaddress
+import threading
+import multiprocessing as mp
+from multiprocessing.connection import Client, Listener, wait
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# --------------------------
+# Configuration
+# --------------------------
+# The RPC pickles requests, so anyone holding the authkey can run code on a shard.
+# The built-in key is public and only allowed on loopback; set GALLERY_AUTHKEY otherwise.
+DEFAULT_AUTHKEY = b"mds25-gallery"
+AUTHKEY = os.environ.get("GALLERY_AUTHKEY", "").encode() or DEFAULT_AUTHKEY
+VIRTUAL_NODES = 64          # Points per shard on the hash ring; more = smoother balance
+SEARCH_TIMEOUT = 0.5        # Seconds to wait for shards before returning partial results
+RECONNECT_INTERVAL = 2.0    # Seconds between reconnect attempts to a down shard
+
+
+def parse_address(address: str) -> Tuple[str, int]:
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+
+def is_loopback(host: str) -> bool:
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except (OSError, ValueError):
+        return False
+
+
+def check_authkey(address: str, authkey: bytes):
+    """Refuse the public default key for anything that is not loopback."""
+    host, _ = parse_address(address)
+    if authkey == DEFAULT_AUTHKEY and not is_loopback(host):
+        raise ValueError(f"Refusing to use the default gallery authkey for non-loopback address {address}; "
+                         "set GALLERY_AUTHKEY to a secret shared by the coordinator and its shards")
+
+
+# --------------------------
+# Shard (one slice of the gallery)
+# --------------------------
+class GalleryShard:
+    """In-memory slice of the gallery: one row per identity in a growable matrix."""
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+        self.names: List[str] = []
+        self.row_of: Dict[str, int] = {}
+        self.embeddings = np.zeros((0, dim), dtype=np.float32)
+        self.lock = threading.Lock()
+
+    def add(self, names: List[str], embeddings) -> int:
+        emb = np.asarray(embeddings, dtype=np.float32).reshape(len(names), self.dim)
+        emb = emb / np.maximum(np.linalg.norm(emb, axis=1, keepdims=True), 1e-12)
+        with self.lock:
+            new = [i for i, n in enumerate(names) if n not in self.row_of]
+            # Grow by doubling so repeated adds stay amortized O(1)
+            needed = len(self.names) + len(new)
+            if needed > self.embeddings.shape[0]:
+                grown = np.zeros((max(needed, 2 * self.embeddings.shape[0], 64), self.dim), dtype=np.float32)
+                grown[:len(self.names)] = self.embeddings[:len(self.names)]
+                self.embeddings = grown
+            for i, name in enumerate(names):
+                row = self.row_of.get(name)
+                if row is None:
+                    row = len(self.names)
+                    self.names.append(name)
+                    self.row_of[name] = row
+                self.embeddings[row] = emb[i]
+            return len(new)
+
+    def remove(self, names: List[str]) -> int:
+        removed = 0
+        with self.lock:
+            for name in names:
+                row = self.row_of.pop(name, None)
+                if row is None:
+                    continue
+                # Swap the last row into the hole to keep rows packed
+                last = len(self.names) - 1
+                if row != last:
+                    moved = self.names[last]
+                    self.names[row] = moved
+                    self.embeddings[row] = self.embeddings[last]
+                    self.row_of[moved] = row
+                self.names.pop()
+                removed += 1
+        return removed
+
+    def export(self, names: Optional[List[str]] = None) -> Tuple[List[str], np.ndarray]:
+        with self.lock:
+            names = list(self.names) if names is None else [n for n in names if n in self.row_of]
+            rows = [self.row_of[n] for n in names]
+            return names, self.embeddings[rows].copy()
+
+    def topk(self, queries, k: int) -> Tuple[np.ndarray, List[List[str]]]:
+        q = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        with self.lock:
+            n = len(self.names)
+            if n == 0:
+                return np.empty((q.shape[0], 0), dtype=np.float32), [[] for _ in range(q.shape[0])]
+            sims = q @ self.embeddings[:n].T
+            k = min(k, n)
+            # Partial sort: only the top k columns of each row get fully ordered
+            idx = np.argpartition(-sims, k - 1, axis=1)[:, :k] if k < n else np.tile(np.arange(n), (q.shape[0], 1))
+            part = np.take_along_axis(sims, idx, axis=1)
+            order = np.argsort(-part, axis=1)
+            idx = np.take_along_axis(idx, order, axis=1)
+            scores = np.take_along_axis(part, order, axis=1)
+            names = [[self.names[j] for j in row] for row in idx]
+            return scores, names
+
+    def handle(self, op: str, payload):
+        if op == "topk":
+            return self.topk(*payload)
+        if op == "add":
+            return self.add(*payload)
+        if op == "remove":
+            return self.remove(payload)
+        if op == "export":
+            return self.export(payload)
+        if op == "names":
+            with self.lock:
+                return list(self.names)
+        if op == "ping":
+            return len(self.names)
+        raise ValueError(f"Unknown op {op!r}")
+
+
+def serve_shard(address: str = "127.0.0.1:0", dim: int = 512, delay: float = 0.0, ready=None,
+                authkey: bytes = AUTHKEY, index: int = 0):
+    """Run a shard server until killed. `delay` simulates a slow shard for testing.
+
+    Once listening, puts (index, "host:port") on `ready` if given.
+    """
+    check_authkey(address, authkey)
+    shard = GalleryShard(dim)
+    listener = Listener(parse_address(address), authkey=authkey)
+    host, port = listener.address
+    if ready is not None:
+        ready.put((index, f"{host}:{port}"))
+
+    def client_loop(conn):
+        try:
+            while True:
+                req_id, op, payload = conn.recv()
+                if delay:
+                    time.sleep(delay)
+                try:
+                    conn.send((req_id, True, shard.handle(op, payload)))
+                except Exception as e:
+                    conn.send((req_id, False, repr(e)))
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+
+    while True:
+        try:
+            conn = listener.accept()
+        except (OSError, EOFError):
+            continue  # e.g. a client that failed authentication
+        threading.Thread(target=client_loop, args=(conn,), daemon=True).start()
+
+
+def start_local_shards(n: int, dim: int = 512, delays: Optional[List[float]] = None) -> Tuple[List[str], List]:
+    """Spawn n shard processes on localhost. Returns (addresses, processes)."""
+    ctx = mp.get_context("spawn")
+    ready = ctx.Queue()
+    procs = []
+    for i in range(n):
+        delay = delays[i] if delays else 0.0
+        proc = ctx.Process(target=serve_shard, args=("127.0.0.1:0", dim, delay, ready, AUTHKEY, i),
+                           name=f"gallery-shard-{i}", daemon=True)
+        proc.start()
+        procs.append(proc)
+    # Shards report in start-up order; sort so addresses[i] belongs to procs[i] and delays[i]
+    addresses = [address for _, address in sorted(ready.get(timeout=30) for _ in range(n))]
+    return addresses, procs
+
+
+# --------------------------
+# Coordinator
+# --------------------------
+class _ShardLink:
+    def __init__(self, address: str, authkey: bytes):
+        self.address = address
+        self.authkey = authkey
+        self.conn = None
+        self.next_retry = 0.0
+        self.pending = None   # req_id of the last request whose reply has not been read
+        self.busy = False     # A gather is reading this connection (outside the coordinator lock)
+        self.retired = False  # Shard left the gallery; close once no gather is using it
+
+    def connect(self) -> bool:
+        if self.conn is not None:
+            return True
+        if self.retired or time.monotonic() < self.next_retry:
+            return False
+        try:
+            self.conn = Client(parse_address(self.address), authkey=self.authkey)
+            self.pending = None
+            return True
+        except OSError:
+            self.next_retry = time.monotonic() + RECONNECT_INTERVAL
+            return False
+
+    def drop(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except OSError:
+                pass
+        self.conn = None
+        self.pending = None
+        self.next_retry = time.monotonic() + RECONNECT_INTERVAL
+
+
+class ShardedGallery:
+    """Scatter-gather top-k over gallery shards running in other processes or hosts.
+
+    Identities are placed with consistent hashing, so adding a shard moves only
+    the identities that now hash to it. A search sends the whole query batch to
+    every shard at once and merges whatever comes back before the timeout; shards
+    that are slow, down or erroring are listed in `missing_shards` instead of failing.
+
+    Searches and writes use separate connections to each shard. The coordinator
+    lock is only held to pick links, never across a round trip, so rebalancing
+    (serialized by its own lock) never stalls a search.
+    """
+
+    def __init__(self, addresses: List[str], dim: int = 512, timeout: float = SEARCH_TIMEOUT,
+                 authkey: bytes = AUTHKEY):
+        self.dim = dim
+        self.timeout = timeout
+        self.authkey = authkey
+        for address in addresses:
+            check_authkey(address, authkey)
+        self._lock = threading.Lock()        # Guards links and the ring; held only briefly
+        self._write_lock = threading.Lock()  # One add/remove/rebalance at a time
+        self._searches_done = threading.Condition(self._lock)
+        self._generation = 0                 # Bumped whenever the searched shard set changes
+        self._active: Dict[int, int] = {}    # generation -> searches in flight against it
+        self._req = 0
+        self._links: Dict[str, _ShardLink] = {a: _ShardLink(a, authkey) for a in addresses}  # Searched shards
+        self._admin: Dict[str, _ShardLink] = {a: _ShardLink(a, authkey) for a in addresses}  # Write traffic
+        self._ring = self._make_ring(addresses)
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+    def _make_ring(self, addresses: List[str]) -> Tuple[List[int], List[str]]:
+        points = sorted((self._hash(f"{address}#{v}"), address)
+                        for address in addresses for v in range(VIRTUAL_NODES))
+        return [h for h, _ in points], [a for _, a in points]
+
+    def owner(self, name: str, ring: Optional[Tuple[List[int], List[str]]] = None) -> str:
+        keys, owners = ring or self._ring
+        i = bisect.bisect(keys, self._hash(name)) % len(keys)
+        return owners[i]
+
+    # --------------------------
+    # Request plumbing
+    # --------------------------
+    def _call(self, address: str, op: str, payload, timeout: Optional[float] = None):
+        """Blocking request to one shard over its write connection."""
+        results, missing, errors = self._scatter({address: (op, payload)}, timeout or max(self.timeout, 30.0),
+                                                 self._admin, allow_pending=True)
+        if address in errors:
+            raise RuntimeError(f"Shard {address} failed {op!r}: {errors[address]}")
+        if address in missing:
+            raise ConnectionError(f"Shard {address} did not answer {op!r}")
+        return results[address]
+
+    @staticmethod
+    def _claim_locked(link: _ShardLink, allow_pending: bool) -> bool:
+        """Reserve a link for one request: connected, not being read by another gather,
+        and (for searches) with no earlier request still unanswered."""
+        if link.busy or not link.connect():
+            return False
+        try:
+            # Skip replies to requests that timed out, without blocking
+            while link.pending is not None and link.conn.poll(0):
+                req_id, _, _ = link.conn.recv()
+                if req_id == link.pending:
+                    link.pending = None
+        except (EOFError, OSError):
+            link.drop()
+            return False
+        if link.pending is not None and not allow_pending:
+            return False  # A new request would only queue behind the slow one
+        link.busy = True
+        return True
+
+    def _scatter(self, requests: Dict[str, Tuple[str, object]], timeout: float,
+                 links: Optional[Dict[str, _ShardLink]] = None, allow_pending: bool = False):
+        """Send each shard its request, then gather replies until the deadline.
+
+        Returns (results, missing, errors); shards that raised are in both `missing`
+        and `errors`.
+        """
+        links = self._links if links is None else links
+        deadline = time.monotonic() + timeout
+        claimed = []
+        missing = []
+        with self._lock:
+            for address in requests:
+                link = links.get(address)  # A search may race a remove_shard
+                if link is None or not self._claim_locked(link, allow_pending):
+                    missing.append(address)
+                    continue
+                self._req += 1
+                claimed.append((link, self._req))
+
+        # Claimed links are only touched by this call, so no lock from here on
+        waiting = {}
+        dead = []
+        for link, req_id in claimed:
+            op, payload = requests[link.address]
+            try:
+                link.conn.send((req_id, op, payload))
+                link.pending = req_id
+                waiting[link.conn] = link
+            except OSError:
+                dead.append(link)
+                missing.append(link.address)
+
+        results = {}
+        errors = {}
+        while waiting:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            for conn in wait(list(waiting), timeout=remaining):
+                link = waiting[conn]
+                try:
+                    req_id, ok, payload = conn.recv()
+                except (EOFError, OSError):
+                    del waiting[conn]
+                    dead.append(link)
+                    missing.append(link.address)
+                    continue
+                if req_id != link.pending:
+                    continue  # Late answer to an earlier request that already timed out
+                del waiting[conn]
+                link.pending = None
+                if ok:
+                    results[link.address] = payload
+                else:
+                    errors[link.address] = payload
+                    missing.append(link.address)
+        # Shards still waiting keep their pending id; the next request skips their late reply
+        missing.extend(link.address for link in waiting.values())
+
+        with self._lock:
+            for link in dead:
+                link.drop()
+            for link, _ in claimed:
+                link.busy = False
+                if link.retired:
+                    link.drop()
+        return results, missing, errors
+
+    # --------------------------
+    # Gallery maintenance
+    # --------------------------
+    def add(self, names: List[str], embeddings):
+        emb = np.asarray(embeddings, dtype=np.float32).reshape(len(names), self.dim)
+        with self._write_lock:
+            by_shard: Dict[str, List[int]] = {}
+            for i, name in enumerate(names):
+                by_shard.setdefault(self.owner(name), []).append(i)
+            for address, rows in by_shard.items():
+                self._call(address, "add", ([names[i] for i in rows], emb[rows]))
+
+    def remove(self, names: List[str]):
+        with self._write_lock:
+            by_shard: Dict[str, List[str]] = {}
+            for name in names:
+                by_shard.setdefault(self.owner(name), []).append(name)
+            for address, shard_names in by_shard.items():
+                self._call(address, "remove", shard_names)
+
+    def add_shard(self, address: str) -> int:
+        """Join a new shard and move over the identities that now hash to it.
+
+        Searches keep using the old shard set while identities are copied; the new
+        shard joins once it holds its copies, and the originals are removed after.
+        """
+        check_authkey(address, self.authkey)
+        with self._write_lock:
+            with self._lock:
+                if address in self._links:
+                    return 0
+                others = list(self._links)
+            self._admin[address] = _ShardLink(address, self.authkey)
+            ring = self._make_ring(others + [address])
+            copied = {}
+            for other in others:
+                names = [n for n in self._call(other, "names", None) if self.owner(n, ring) == address]
+                if names:
+                    copied[other] = self._copy(other, address, names)
+            with self._lock:
+                self._links[address] = _ShardLink(address, self.authkey)
+                self._ring = ring
+                # A search that went out before the switch never asked the new shard,
+                # so the originals must outlive it (bounded by the search timeout)
+                self._generation += 1
+                while any(count for gen, count in self._active.items() if gen < self._generation):
+                    self._searches_done.wait()
+            # Until these removes land, search() sees both copies and keeps one per name
+            for other, names in copied.items():
+                self._call(other, "remove", names)
+            return sum(len(names) for names in copied.values())
+
+    def remove_shard(self, address: str) -> int:
+        """Drain a live shard onto the remaining ones and take it out of the ring."""
+        with self._write_lock:
+            with self._lock:
+                if address not in self._links or len(self._links) == 1:
+                    return 0
+                remaining = [a for a in self._links if a != address]
+            ring = self._make_ring(remaining)
+            by_owner: Dict[str, List[str]] = {}
+            for name in self._call(address, "names", None):
+                by_owner.setdefault(self.owner(name, ring), []).append(name)
+            # The draining shard stays searchable until every identity has a new home
+            moved = sum(len(self._copy(address, target, group)) for target, group in by_owner.items())
+            with self._lock:
+                link = self._links.pop(address)
+                self._ring = ring
+                link.retired = True
+                if not link.busy:
+                    link.drop()
+            self._admin.pop(address).drop()
+            return moved
+
+    def _copy(self, source: str, target: str, names: List[str]) -> List[str]:
+        # Copy before anything is deleted, so a failure part-way never loses an identity
+        names, emb = self._call(source, "export", names)
+        self._call(target, "add", (names, emb))
+        return names
+
+    def shard_sizes(self) -> Dict[str, Optional[int]]:
+        # Over the write connections, so a busy search link does not read as a down shard
+        with self._write_lock:
+            addresses = list(self._admin)
+            results, _, _ = self._scatter({a: ("ping", None) for a in addresses}, self.timeout, self._admin,
+                                          allow_pending=True)
+        return {a: results.get(a) for a in addresses}
+
+    # --------------------------
+    # Search
+    # --------------------------
+    def search(self, queries, k: int = 5, similarity_threshold: Optional[float] = None,
+               timeout: Optional[float] = None) -> Dict:
+        """Top-k identities for each query embedding, merged across shards.
+
+        Returns {"names", "scores", "identities", "best_scores", "missing_shards", "shards"}.
+        `identities[i]` is the best name if it clears `similarity_threshold`, else
+        "Unknown". With missing shards the result is best-effort over the rest; if
+        every shard is missing, "Unknown" means the gallery could not be asked.
+        """
+        q = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        q = q / np.maximum(np.linalg.norm(q, axis=1, keepdims=True), 1e-12)
+        with self._lock:
+            requests = {a: ("topk", (q, k)) for a in self._links}
+            generation = self._generation
+            self._active[generation] = self._active.get(generation, 0) + 1
+        try:
+            results, missing, _ = self._scatter(requests, self.timeout if timeout is None else timeout)
+        finally:
+            with self._lock:
+                self._active[generation] -= 1
+                if not self._active[generation]:
+                    del self._active[generation]
+                self._searches_done.notify_all()
+
+        # Merge: stack every shard's top-k side by side, then keep the best k distinct names
+        # per row (an identity is on two shards while it is being moved)
+        parts = [r for r in results.values() if r[0].shape[1]]
+        top_names = [[] for _ in range(q.shape[0])]
+        top_scores = np.full((q.shape[0], min(k, sum(p[0].shape[1] for p in parts))), -np.inf, dtype=np.float32)
+        if parts:
+            scores = np.concatenate([p[0] for p in parts], axis=1)
+            names = [sum((p[1][i] for p in parts), []) for i in range(q.shape[0])]
+            order = np.argsort(-scores, axis=1)
+            for i in range(q.shape[0]):
+                for j in order[i]:
+                    if len(top_names[i]) == top_scores.shape[1]:
+                        break
+                    if names[i][j] not in top_names[i]:
+                        top_scores[i, len(top_names[i])] = scores[i, j]
+                        top_names[i].append(names[i][j])
+
+        best_scores = top_scores[:, 0] if top_scores.shape[1] else np.full(q.shape[0], -1.0, dtype=np.float32)
+        identities = []
+        for i in range(q.shape[0]):
+            ok = top_names[i] and (similarity_threshold is None or best_scores[i] >= similarity_threshold)
+            identities.append(top_names[i][0] if ok else "Unknown")
+        return {"names": top_names, "scores": top_scores, "identities": identities,
+                "best_scores": best_scores, "missing_shards": sorted(missing), "shards": len(requests)}
+
+    def close(self):
+        with self._write_lock, self._lock:
+            for link in list(self._links.values()) + list(self._admin.values()):
+                link.drop()
+
+
+# --------------------------
+# Benchmark
+# --------------------------
+def benchmark(max_shards: int = None, gallery_size: int = 100000, batch: int = 32, seconds: float = 5.0,
+              k: int = 5, dim: int = 512) -> List[Dict[str, float]]:
+    """Queries per second against shard count for a synthetic gallery on localhost."""
+    max_shards = max_shards or os.cpu_count() or 1
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((gallery_size, dim)).astype(np.float32)
+    names = [f"person-{i}" for i in range(gallery_size)]
+    queries = embeddings[rng.integers(0, gallery_size, batch)] + 0.1 * rng.standard_normal((batch, dim)).astype(np.float32)
+
+    rows = []
+    for n in range(1, max_shards + 1):
+        addresses, procs = start_local_shards(n, dim)
+        gallery = ShardedGallery(addresses, dim, timeout=30.0)
+        for i in range(0, gallery_size, 10000):
+            gallery.add(names[i:i + 10000], embeddings[i:i + 10000])
+        gallery.search(queries, k)  # Warm-up
+
+        done = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            result = gallery.search(queries, k)
+            done += batch
+        elapsed = time.perf_counter() - start
+        qps = done / elapsed
+        rows.append({"shards": n, "qps": qps, "speedup": qps / rows[0]["qps"] if rows else 1.0,
+                     "missing": len(result["missing_shards"])})
+        gallery.close()
+        for proc in procs:
+            proc.terminate()
+            proc.join()
+    return rows
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Sharded face gallery: shard server, loader and benchmark")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_serve = sub.add_parser("serve", help="Run one shard server")
+    p_serve.add_argument("--address", default="127.0.0.1:6001")
+    p_serve.add_argument("--dim", type=int, default=512)
+
+    p_load = sub.add_parser("load", help="Load an embeddings cache into running shards")
+    p_load.add_argument("--shards", required=True, help="Comma-separated host:port list")
+    p_load.add_argument("--cache", default="embeddings_cache/buffalo_l_embeddings.pkl")
+
+    p_bench = sub.add_parser("bench", help="Queries per second against shard count")
+    p_bench.add_argument("--max-shards", type=int, default=os.cpu_count())
+    p_bench.add_argument("--gallery-size", type=int, default=100000)
+    p_bench.add_argument("--batch", type=int, default=32)
+    p_bench.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        print(f"Serving gallery shard on {args.address}", file=sys.stderr)
+        serve_shard(args.address, args.dim)
+    elif args.command == "load":
+        with open(args.cache, 'rb') as f:
+            cache_data = pickle.load(f)
+        gallery = ShardedGallery(args.shards.split(","))
+        gallery.add(list(cache_data['names']), np.stack(cache_data['embeddings']))
+        print(gallery.shard_sizes())
+        gallery.close()
+    else:
+        print(f"{'shards':>7} {'qps':>10} {'speedup':>8}")
+        for row in benchmark(args.max_shards, args.gallery_size, args.batch, args.seconds):
+            print(f"{row['shards']:>7} {row['qps']:>10.0f} {row['speedup']:>8.2f}")
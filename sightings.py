@@ -0,0 +1,605 @@
+import os
+import json
+import time
+import queue
+import shutil
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# --------------------------
+# Configuration
+# --------------------------
+SIGHTINGS_DIR = "sightings"
+CHUNK_ROWS = 65536          # Seal a chunk once it holds this many sightings
+CHUNK_SECONDS = 60.0        # ...or once its oldest pending sighting is this old (bounds loss on a crash)
+COMPACT_FANIN = 16          # Merge this many same-level chunks into one chunk of the next level
+COMPACT_ROWS = 1_000_000    # Chunks at least this big are final and never merged again
+MAINTENANCE_INTERVAL = 60.0 # Seconds between compaction/retention passes
+MERGE_BLOCK = 65536         # Rows copied per step while merging, so compaction memory stays bounded
+WRITE_QUEUE_SIZE = 10000    # Bounded hand-off queue between the video thread and the writer
+NAMES_FILE = "names.json"
+META_FILE = "meta.json"
+INDEX_FILE = "by_identity.npy"
+
+# Column name -> (dtype, per-row shape); "embedding" is optional and sized on first use
+COLUMNS = {
+    "ts": (np.float64, ()),
+    "stream": (np.int32, ()),
+    "identity": (np.int32, ()),
+    "score": (np.float32, ()),
+    "bbox": (np.float32, (4,)),
+    "cluster": (np.int64, ()),  # N of an "unknown-N" cluster for identity "Unknown", else -1
+}
+# Value for rows of chunks written before a column existed (and for rows without an embedding)
+COLUMN_FILL = {"cluster": -1, "embedding": np.nan}
+
+
+class SightingStore:
+    """Append-only, chunked, columnar on-disk log of face sightings.
+
+    Each sealed chunk is a directory of .npy columns sorted by timestamp, plus a
+    row permutation grouped by identity and a meta.json holding each identity's
+    slice of it. Stream and identity strings are dictionary-encoded as int32
+    codes shared across chunks. Small chunks are merged in tiers in the
+    background, so months of data stay at a few hundred chunks, and queries
+    only read the rows of the identity they ask for.
+    """
+
+    def __init__(self, root: str = SIGHTINGS_DIR, chunk_rows: int = CHUNK_ROWS,
+                 chunk_seconds: float = CHUNK_SECONDS, retention_seconds: Optional[float] = None,
+                 store_embeddings: bool = True, queue_size: int = WRITE_QUEUE_SIZE,
+                 compact_fanin: int = COMPACT_FANIN, compact_rows: int = COMPACT_ROWS,
+                 maintenance_interval: float = MAINTENANCE_INTERVAL):
+        self.root = root
+        self.chunk_rows = chunk_rows
+        self.chunk_seconds = chunk_seconds
+        self.retention_seconds = retention_seconds
+        self.store_embeddings = store_embeddings
+        self.compact_fanin = compact_fanin
+        self.compact_rows = compact_rows
+        self.maintenance_interval = maintenance_interval
+        self.dropped = 0  # Sightings discarded because the write queue was full
+
+        os.makedirs(self.root, exist_ok=True)
+        self._lock = threading.Lock()              # Guards the index, names and pending rows (never held for I/O)
+        self._seal_lock = threading.Lock()         # One seal at a time (writer thread or flush)
+        self._maintenance_lock = threading.Lock()  # Compaction and retention never overlap
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._wake_maintenance = threading.Event()
+
+        # Dictionary encoding for stream/identity strings
+        self._names: List[str] = []
+        self._codes: Dict[str, int] = {}
+        self._load_names()
+
+        # Chunk index: meta per sealed chunk, time bounds per chunk, identity -> chunks posting lists
+        self._chunks: Dict[int, dict] = {}
+        self._chunk_ids: List[int] = []
+        self._chunk_min = np.empty(0, dtype=np.float64)
+        self._chunk_max = np.empty(0, dtype=np.float64)
+        self._postings: Dict[int, List[int]] = {}
+        self._next_chunk = 0
+        self._load_index()
+
+        # Rows received by the writer but not yet sealed, and rows being written right now
+        self._pending = self._empty_pending()
+        self._pending_since = None
+        self._sealing: Optional[Dict[str, np.ndarray]] = None
+        self._embedding_dim = None
+
+        self._writer = threading.Thread(target=self._writer_loop, name="sighting-writer", daemon=True)
+        self._writer.start()
+        self._maintainer = threading.Thread(target=self._maintenance_loop, name="sighting-maintenance",
+                                            daemon=True)
+        self._maintainer.start()
+
+    # --------------------------
+    # Write path
+    # --------------------------
+    def append(self, timestamp: float, stream: str, identity: str, score: float,
+               bbox, embedding=None, cluster: int = -1) -> bool:
+        """Queue one sighting for writing. Never blocks; returns False if dropped.
+
+        Unrecognized faces should be recorded as identity "Unknown" with their
+        cluster id, so the identity dictionary stays bounded by the gallery.
+        """
+        try:
+            self._queue.put_nowait((timestamp, stream, identity, score, bbox, embedding, cluster))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def flush(self):
+        """Wait for queued sightings to be consumed and seal whatever is pending."""
+        self._queue.join()
+        self._seal()
+
+    def close(self):
+        self.flush()
+        self._stop.set()
+        self._wake_maintenance.set()
+        self._writer.join(timeout=5.0)
+        self._maintainer.join(timeout=30.0)
+
+    def _writer_loop(self):
+        while not self._stop.is_set():
+            try:
+                batch = [self._queue.get(timeout=0.5)]
+            except queue.Empty:
+                batch = []
+            # Drain whatever else is already waiting so we take the lock once per batch
+            while len(batch) < 1024:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            with self._lock:
+                for row in batch:
+                    self._add_pending_locked(*row)
+                due = self._pending_since is not None and (
+                    len(self._pending["ts"]) >= self.chunk_rows
+                    or time.time() - self._pending_since >= self.chunk_seconds)
+            if due:
+                self._seal()
+                self._wake_maintenance.set()
+
+            for _ in batch:
+                self._queue.task_done()
+
+    @staticmethod
+    def _empty_pending() -> Dict[str, list]:
+        pending = {c: [] for c in COLUMNS}
+        pending["embedding"] = []
+        return pending
+
+    def _add_pending_locked(self, timestamp, stream, identity, score, bbox, embedding, cluster):
+        if self._pending_since is None:
+            self._pending_since = time.time()
+        p = self._pending
+        p["ts"].append(float(timestamp))
+        p["stream"].append(self._code(stream))
+        p["identity"].append(self._code(identity))
+        p["score"].append(float(score))
+        p["bbox"].append(np.asarray(bbox, dtype=np.float32).reshape(4))
+        p["cluster"].append(int(cluster))
+        if self.store_embeddings:
+            if embedding is not None:
+                embedding = np.asarray(embedding, dtype=np.float32).ravel()
+                if self._embedding_dim is None:
+                    self._embedding_dim = embedding.shape[0]
+            p["embedding"].append(embedding)
+
+    def _pending_arrays_locked(self) -> Dict[str, np.ndarray]:
+        p = self._pending
+        n = len(p["ts"])
+        cols = {name: np.asarray(p[name], dtype=dtype).reshape((n,) + shape)
+                for name, (dtype, shape) in COLUMNS.items()}
+        if self.store_embeddings and self._embedding_dim is not None:
+            # Rows without an embedding are stored as NaN so the column stays rectangular
+            emb = np.full((n, self._embedding_dim), np.nan, dtype=np.float32)
+            for i, e in enumerate(p["embedding"]):
+                if e is not None:
+                    emb[i] = e
+            cols["embedding"] = emb
+        return cols
+
+    def _seal(self):
+        with self._seal_lock:
+            with self._lock:
+                if not self._pending["ts"]:
+                    return
+                cols = self._pending_arrays_locked()
+                order = np.argsort(cols["ts"], kind="stable")
+                cols = {k: v[order] for k, v in cols.items()}
+                # Stays visible to queries while it is written outside the lock
+                self._sealing = cols
+                self._pending = self._empty_pending()
+                self._pending_since = None
+                chunk_id = self._next_chunk
+                self._next_chunk += 1
+                names = list(self._names)
+
+            # Names must hit disk before any chunk that references their codes
+            self._save_names(names)
+            tmp_dir = self._chunk_dir(chunk_id) + ".tmp"
+            os.makedirs(tmp_dir, exist_ok=True)
+            for name, arr in cols.items():
+                np.save(os.path.join(tmp_dir, f"{name}.npy"), arr)
+            meta = self._finish_chunk(chunk_id, tmp_dir, cols["identity"], cols["ts"], level=0)
+
+            with self._lock:
+                self._add_to_index_locked(chunk_id, meta)
+                self._sealing = None
+
+    def _finish_chunk(self, chunk_id: int, tmp_dir: str, identity: np.ndarray, ts: np.ndarray,
+                      level: int, sources: Optional[List[int]] = None) -> dict:
+        """Write the identity index and meta for a chunk whose columns are in tmp_dir, then publish it."""
+        # Stable sort keeps each identity's rows in time order
+        by_identity = np.argsort(identity, kind="stable").astype(np.int64)
+        codes, starts, counts = np.unique(np.asarray(identity)[by_identity], return_index=True, return_counts=True)
+        np.save(os.path.join(tmp_dir, INDEX_FILE), by_identity)
+        meta = {
+            "rows": int(ts.shape[0]),
+            "min_ts": float(ts[0]),
+            "max_ts": float(ts[-1]),
+            "level": level,
+            "sources": sources or [],  # Chunks merged into this one; dropped on load if a crash left them
+            "identities": {str(c): [int(s), int(s + n)] for c, s, n in zip(codes, starts, counts)},
+        }
+        with open(os.path.join(tmp_dir, META_FILE), "w") as f:
+            json.dump(meta, f)
+        # Rename so a crash never leaves a half-written chunk
+        os.replace(tmp_dir, self._chunk_dir(chunk_id))
+        return meta
+
+    # --------------------------
+    # Index & names
+    # --------------------------
+    def _chunk_dir(self, chunk_id: int) -> str:
+        return os.path.join(self.root, f"chunk_{chunk_id:08d}")
+
+    def _code(self, name: str) -> int:
+        code = self._codes.get(name)
+        if code is None:
+            code = len(self._names)
+            self._names.append(name)
+            self._codes[name] = code
+        return code
+
+    def _load_names(self):
+        path = os.path.join(self.root, NAMES_FILE)
+        if os.path.exists(path):
+            with open(path) as f:
+                self._names = json.load(f)
+            self._codes = {n: i for i, n in enumerate(self._names)}
+
+    def _save_names(self, names: List[str]):
+        path = os.path.join(self.root, NAMES_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump(names, f)
+        os.replace(path + ".tmp", path)
+
+    def _load_index(self):
+        metas: Dict[int, dict] = {}
+        for entry in sorted(os.listdir(self.root)):
+            path = os.path.join(self.root, entry)
+            if entry.endswith((".tmp", ".trash")):
+                shutil.rmtree(path, ignore_errors=True)  # Leftover from an interrupted seal/merge/drop
+                continue
+            if not entry.startswith("chunk_"):
+                continue
+            chunk_id = int(entry[len("chunk_"):])
+            with open(os.path.join(path, META_FILE)) as f:
+                metas[chunk_id] = json.load(f)
+            self._next_chunk = max(self._next_chunk, chunk_id + 1)
+
+        # A crash between publishing a merged chunk and trashing its sources leaves
+        # both on disk; the merged chunk wins so no row is counted twice
+        merged = {src for meta in metas.values() for src in meta.get("sources", [])}
+        for chunk_id, meta in metas.items():
+            if chunk_id in merged:
+                shutil.rmtree(self._chunk_dir(chunk_id), ignore_errors=True)
+            else:
+                self._add_to_index_locked(chunk_id, meta)
+
+    def _add_to_index_locked(self, chunk_id: int, meta: dict):
+        self._chunks[chunk_id] = meta
+        for code in meta["identities"]:
+            self._postings.setdefault(int(code), []).append(chunk_id)
+        self._rebuild_bounds_locked()
+
+    def _remove_from_index_locked(self, chunk_ids: List[int]):
+        for chunk_id in chunk_ids:
+            meta = self._chunks.pop(chunk_id)
+            for code in meta["identities"]:
+                posting = self._postings[int(code)]
+                posting.remove(chunk_id)
+                if not posting:
+                    del self._postings[int(code)]
+        self._rebuild_bounds_locked()
+
+    def _rebuild_bounds_locked(self):
+        self._chunk_ids = sorted(self._chunks)
+        self._chunk_min = np.array([self._chunks[c]["min_ts"] for c in self._chunk_ids], dtype=np.float64)
+        self._chunk_max = np.array([self._chunks[c]["max_ts"] for c in self._chunk_ids], dtype=np.float64)
+
+    def _trash_locked(self, chunk_ids: List[int]) -> List[str]:
+        """Take chunks out of the index and rename them aside; the caller deletes them unlocked."""
+        self._remove_from_index_locked(chunk_ids)
+        trashed = []
+        for chunk_id in chunk_ids:
+            path = self._chunk_dir(chunk_id)
+            os.replace(path, path + ".trash")
+            trashed.append(path + ".trash")
+        return trashed
+
+    # --------------------------
+    # Maintenance: compaction & retention
+    # --------------------------
+    def _maintenance_loop(self):
+        while not self._stop.is_set():
+            self._wake_maintenance.wait(timeout=self.maintenance_interval)
+            self._wake_maintenance.clear()
+            if self._stop.is_set():
+                break
+            self.apply_retention()
+            self.compact()
+
+    def compact(self) -> int:
+        """Merge full groups of small chunks, tier by tier. Returns the number of merges."""
+        merges = 0
+        with self._maintenance_lock:
+            while True:
+                with self._lock:
+                    group = self._pick_merge_group_locked()
+                    if group is None:
+                        return merges
+                    level = max(self._chunks[c]["level"] for c in group) + 1
+                    chunk_id = self._next_chunk
+                    self._next_chunk += 1
+                meta = self._merge(group, chunk_id, level)
+                with self._lock:
+                    self._add_to_index_locked(chunk_id, meta)
+                    trashed = self._trash_locked(group)
+                for path in trashed:
+                    shutil.rmtree(path, ignore_errors=True)
+                merges += 1
+
+    def _pick_merge_group_locked(self) -> Optional[List[int]]:
+        by_level: Dict[int, List[int]] = {}
+        for chunk_id in self._chunk_ids:
+            meta = self._chunks[chunk_id]
+            if meta["rows"] < self.compact_rows:
+                by_level.setdefault(meta["level"], []).append(chunk_id)
+        for level in sorted(by_level):
+            if len(by_level[level]) >= self.compact_fanin:
+                return by_level[level][:self.compact_fanin]
+        return None
+
+    def _merge(self, group: List[int], chunk_id: int, level: int) -> dict:
+        """Merge chunks into one time-sorted chunk, copying block by block through memmaps."""
+        sources = [self._open_chunk(c) for c in group]
+        ts_all = np.concatenate([np.asarray(s["ts"]) for s in sources])
+        order = np.argsort(ts_all, kind="stable")
+        offsets = np.cumsum([0] + [s["ts"].shape[0] for s in sources])
+        n = ts_all.shape[0]
+
+        specs = dict(COLUMNS)
+        emb_dims = [s["embedding"].shape[1] for s in sources if "embedding" in s]
+        if emb_dims:
+            specs["embedding"] = (np.float32, (emb_dims[0],))
+
+        tmp_dir = self._chunk_dir(chunk_id) + ".tmp"
+        os.makedirs(tmp_dir, exist_ok=True)
+        for name, (dtype, shape) in specs.items():
+            out = np.lib.format.open_memmap(os.path.join(tmp_dir, f"{name}.npy"), mode="w+",
+                                            dtype=dtype, shape=(n,) + shape)
+            for b in range(0, n, MERGE_BLOCK):
+                idx = order[b:b + MERGE_BLOCK]
+                which = np.searchsorted(offsets, idx, side="right") - 1
+                block = np.full((idx.shape[0],) + shape, COLUMN_FILL.get(name, 0), dtype=dtype)
+                for k in np.unique(which):
+                    if name not in sources[k]:
+                        continue  # e.g. a chunk sealed without embeddings keeps the fill value
+                    mask = which == k
+                    block[mask] = sources[k][name][idx[mask] - offsets[k]]
+                out[b:b + idx.shape[0]] = block
+            out.flush()
+            del out
+        identity = np.load(os.path.join(tmp_dir, "identity.npy"))
+        return self._finish_chunk(chunk_id, tmp_dir, identity, ts_all[order], level, sources=list(group))
+
+    def _open_chunk(self, chunk_id: int) -> Dict[str, np.ndarray]:
+        path = self._chunk_dir(chunk_id)
+        cols = {}
+        for name in list(COLUMNS) + ["embedding", INDEX_FILE[:-4]]:
+            file = os.path.join(path, f"{name}.npy")
+            if os.path.exists(file):
+                cols[name] = np.load(file, mmap_mode="r")
+        if "ts" not in cols:
+            raise FileNotFoundError(path)
+        return cols
+
+    def apply_retention(self, now: Optional[float] = None) -> int:
+        """Drop every sealed chunk whose newest sighting is older than the retention window."""
+        if self.retention_seconds is None:
+            return 0
+        now = time.time() if now is None else now
+        with self._maintenance_lock:
+            with self._lock:
+                expired = [c for c, hi in zip(self._chunk_ids, self._chunk_max)
+                           if hi < now - self.retention_seconds]
+                trashed = self._trash_locked(expired) if expired else []
+            for path in trashed:
+                shutil.rmtree(path, ignore_errors=True)
+        return len(trashed)
+
+    # --------------------------
+    # Read path
+    # --------------------------
+    def _snapshot(self, start: float, end: float, identity: Optional[str], stream: Optional[str]):
+        """Capture everything a query needs under the lock; the reads then happen unlocked."""
+        with self._lock:
+            identity_code = self._codes.get(identity) if identity is not None else None
+            stream_code = self._codes.get(stream) if stream is not None else None
+            if (identity is not None and identity_code is None) or (stream is not None and stream_code is None):
+                return None
+            overlap = (self._chunk_max >= start) & (self._chunk_min <= end)
+            chunks = [(c, self._chunks[c]) for c, ok in zip(self._chunk_ids, overlap) if ok]
+            if identity_code is not None:
+                posting = set(self._postings.get(identity_code, []))
+                chunks = [(c, m) for c, m in chunks if c in posting]
+            in_memory = [self._pending_arrays_locked()] if self._pending["ts"] else []
+            if self._sealing is not None:
+                in_memory.append(self._sealing)
+            return identity_code, stream_code, chunks, in_memory, list(self._names)
+
+    def query(self, start: Optional[float] = None, end: Optional[float] = None,
+              identity: Optional[str] = None, stream: Optional[str] = None,
+              with_embeddings: bool = False) -> Dict[str, np.ndarray]:
+        """Return all sightings in [start, end] matching the filters, ordered by time.
+
+        The result maps column names to arrays; "stream" and "identity" are decoded
+        back to strings. With `with_embeddings`, "embedding" is None if no matching
+        chunk stored embeddings.
+        """
+        start = -np.inf if start is None else start
+        end = np.inf if end is None else end
+
+        # A concurrent merge or retention pass can remove a chunk we planned to read;
+        # its rows then live in a newer chunk, so take a fresh snapshot and retry
+        for attempt in range(3):
+            snap = self._snapshot(start, end, identity, stream)
+            if snap is None:
+                return self._decode(self._empty_result(with_embeddings), [])
+            identity_code, stream_code, chunks, in_memory, names = snap
+            try:
+                parts = [self._read_chunk(c, m, start, end, identity_code, stream_code, with_embeddings)
+                         for c, m in chunks]
+                break
+            except FileNotFoundError:
+                if attempt == 2:
+                    raise
+        parts += [self._filter(cols, start, end, identity_code, stream_code, with_embeddings) for cols in in_memory]
+
+        parts = [p for p in parts if p["ts"].shape[0]]
+        if not parts:
+            return self._decode(self._empty_result(with_embeddings), names)
+        result = {k: np.concatenate([p[k] for p in parts]) for k in COLUMNS}
+        order = np.argsort(result["ts"], kind="stable")
+        result = {k: v[order] for k, v in result.items()}
+        if with_embeddings:
+            emb = self._concat_embeddings(parts)
+            result["embedding"] = emb[order] if emb is not None else None
+        return self._decode(result, names)
+
+    def last_seen(self, identity: str, stream: Optional[str] = None) -> Optional[float]:
+        """Timestamp of the most recent sighting of `identity` (optionally on one stream)."""
+        for attempt in range(3):
+            snap = self._snapshot(-np.inf, np.inf, identity, stream)
+            if snap is None:
+                return None
+            identity_code, stream_code, chunks, in_memory, _ = snap
+            best = None
+            for cols in in_memory:
+                hit = self._filter(cols, -np.inf, np.inf, identity_code, stream_code, False)
+                if hit["ts"].shape[0]:
+                    best = max(best or -np.inf, float(hit["ts"].max()))
+
+            # Walk this identity's chunks newest-first and stop once no chunk can beat `best`
+            try:
+                for chunk_id, meta in sorted(chunks, key=lambda cm: cm[1]["max_ts"], reverse=True):
+                    if best is not None and meta["max_ts"] <= best:
+                        break
+                    ts = self._last_ts(chunk_id, meta, identity_code, stream_code)
+                    if ts is not None:
+                        best = max(best or -np.inf, ts)
+                return best
+            except FileNotFoundError:
+                if attempt == 2:
+                    raise
+        return None
+
+    def _last_ts(self, chunk_id: int, meta: dict, identity_code: int, stream_code: Optional[int]) -> Optional[float]:
+        lo, hi = meta["identities"].get(str(identity_code), (0, 0))
+        if hi <= lo:
+            return None
+        cols = self._open_chunk(chunk_id)
+        if stream_code is None:
+            # The identity's rows are time-ordered, so its newest sighting is its last row
+            return float(cols["ts"][cols["by_identity"][hi - 1]])
+        rows = np.asarray(cols["by_identity"][lo:hi])
+        rows = rows[np.asarray(cols["stream"][rows]) == stream_code]
+        return float(cols["ts"][rows[-1]]) if rows.shape[0] else None
+
+    def _read_chunk(self, chunk_id: int, meta: dict, start: float, end: float, identity_code, stream_code,
+                    with_embeddings: bool) -> Dict[str, np.ndarray]:
+        cols = self._open_chunk(chunk_id)
+        ts = cols["ts"]
+        if identity_code is not None:
+            # Only this identity's rows, via the per-chunk identity index
+            lo, hi = meta["identities"].get(str(identity_code), (0, 0))
+            rows = np.asarray(cols["by_identity"][lo:hi])
+            row_ts = np.asarray(ts[rows])
+            a, b = np.searchsorted(row_ts, start, side="left"), np.searchsorted(row_ts, end, side="right")
+            rows = rows[a:b]
+        else:
+            # Chunks are sorted by time, so the range is a contiguous slice
+            a, b = np.searchsorted(ts, start, side="left"), np.searchsorted(ts, end, side="right")
+            rows = np.arange(a, b)
+        if stream_code is not None:
+            rows = rows[np.asarray(cols["stream"][rows]) == stream_code]
+        out = {name: np.asarray(cols[name][rows]) if name in cols
+               else np.full((rows.shape[0],) + shape, COLUMN_FILL[name], dtype=dtype)
+               for name, (dtype, shape) in COLUMNS.items()}
+        if with_embeddings:
+            out["embedding"] = np.asarray(cols["embedding"][rows]) if "embedding" in cols else None
+        return out
+
+    @staticmethod
+    def _filter(cols: Dict[str, np.ndarray], start, end, identity_code, stream_code,
+                with_embeddings: bool) -> Dict[str, np.ndarray]:
+        mask = (cols["ts"] >= start) & (cols["ts"] <= end)
+        if identity_code is not None:
+            mask &= cols["identity"] == identity_code
+        if stream_code is not None:
+            mask &= cols["stream"] == stream_code
+        out = {k: np.asarray(cols[k])[mask] for k in COLUMNS}
+        if with_embeddings:
+            out["embedding"] = np.asarray(cols["embedding"])[mask] if "embedding" in cols else None
+        return out
+
+    @staticmethod
+    def _concat_embeddings(parts: List[Dict[str, np.ndarray]]) -> Optional[np.ndarray]:
+        dims = [p["embedding"].shape[1] for p in parts if p.get("embedding") is not None]
+        if not dims:
+            return None
+        dim = dims[0]
+        return np.concatenate([
+            p["embedding"] if p.get("embedding") is not None
+            else np.full((p["ts"].shape[0], dim), np.nan, dtype=np.float32)
+            for p in parts
+        ])
+
+    @staticmethod
+    def _empty_result(with_embeddings: bool) -> Dict[str, np.ndarray]:
+        out = {name: np.empty((0,) + shape, dtype=dtype) for name, (dtype, shape) in COLUMNS.items()}
+        if with_embeddings:
+            out["embedding"] = None
+        return out
+
+    @staticmethod
+    def _decode(cols: Dict[str, np.ndarray], names: List[str]) -> Dict[str, np.ndarray]:
+        names = np.asarray(names, dtype=object)
+        for key in ("stream", "identity"):
+            cols[key] = names[cols[key]] if cols[key].shape[0] else np.empty(0, dtype=object)
+        return cols
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "chunks": len(self._chunk_ids),
+                "pending": len(self._pending["ts"]),
+                "queued": self._queue.qsize(),
+                "dropped": self.dropped,
+            }
+
+
+if __name__ == "__main__":
+    # Example: "when was Yousuf last seen on camera 3"
+    import sys
+
+    store = SightingStore()
+    who = sys.argv[1] if len(sys.argv) > 1 else "Yousuf"
+    where = sys.argv[2] if len(sys.argv) > 2 else None
+    seen = store.last_seen(who, where)
+    if seen is None:
+        print(f"{who} has not been seen" + (f" on {where}" if where else ""))
+    else:
+        print(f"{who} last seen" + (f" on {where}" if where else "") + f" at {time.ctime(seen)}")
+    store.close()
@@ -2,15 +2,21 @@ import os
 import time
 import queue
 import pickle
+import threading
 from pathlib import Path
 from typing import List, Dict, Any
 
-import av
 import cv2
 import numpy as np
 import streamlit as st
 from streamlit_webrtc import WebRtcMode, webrtc_streamer
 from insightface.app import FaceAnalysis
+from sightings import SightingStore, SIGHTINGS_DIR
+from unknown_clusters import UnknownFaceClusterer
+from worker_pool import InferenceWorkerPool, InsightFaceRecognizer
+from quality import FaceQualityGate
+from processor import FaceRecognitionProcessor
+from sharded_gallery import ShardedGallery
 
 # --------------------------
 # Configuration & Directories
@@ -23,6 +29,8 @@ PROVIDERS = ['CUDAExecutionProvider', 'CPUExecutionProvider']
 EMBEDDINGS_CACHE_DIR = "embeddings_cache"
 FACE_DETECTION_SIZE = (320, 320)  # Reduced detection size for faster processing
 PROCESS_EVERY_N_FRAMES = 2  # Process every Nth frame for better performance
+SIGHTING_RETENTION_DAYS = 30  # Older sighting chunks are deleted by the store's maintenance thread
+CLUSTER_ID_OFFSETS = {MODEL_LARGE: 0, MODEL_SMALL: 1_000_000_000}  # unknown-N ranges per model
 
 # --------------------------
 # Sidebar: Model Selection & Threshold
@@ -32,6 +40,16 @@ similarity_threshold = st.sidebar.slider("Similarity Threshold", 0.0, 1.0, 0.3,
 process_every_n_frames = st.sidebar.slider("Process every Nth frame", 1, 5, PROCESS_EVERY_N_FRAMES)
 downscale_factor = st.sidebar.slider("Downscale Factor", 1.0, 4.0, 1.5, 0.5)
 use_central_region = st.sidebar.checkbox("Process only central region", value=False)
+record_sightings = st.sidebar.checkbox("Record sightings", value=False)
+sighting_retention_days = st.sidebar.number_input("Keep sightings for (days)", 1, 365, SIGHTING_RETENTION_DAYS,
+                                                  disabled=not record_sightings)
+cluster_unknowns = st.sidebar.checkbox("Cluster unknown faces", value=True)
+use_quality_gate = st.sidebar.checkbox("Skip low-quality faces before embedding", value=True)
+num_inference_workers = st.sidebar.slider("Inference worker processes (0 = in-process)", 0, os.cpu_count() or 1, 0)
+with st.sidebar.expander("Sharded Gallery"):
+    # host:port of running shard servers (python sharded_gallery.py serve); empty = local gallery
+    shards_large = st.text_input(f"{MODEL_LARGE} shards", placeholder="127.0.0.1:6001,127.0.0.1:6002")
+    shards_small = st.text_input(f"{MODEL_SMALL} shards", placeholder="127.0.0.1:7001,127.0.0.1:7002")
 
 # Ensure cache directory exists
 os.makedirs(EMBEDDINGS_CACHE_DIR, exist_ok=True)
@@ -52,6 +70,55 @@ with st.sidebar:
         face_app_small = load_face_analysis(MODEL_SMALL)
     st.success("Models loaded successfully")
 
+@st.cache_resource
+def worker_pool_slot(model_name: str) -> Dict[str, Any]:
+    # One live pool per model; changing its settings replaces it instead of leaking processes
+    return {"lock": threading.Lock(), "config": None, "pool": None}
+
+def load_worker_pool(model_name: str, num_workers: int, quality_gate: bool) -> InferenceWorkerPool:
+    slot = worker_pool_slot(model_name)
+    with slot["lock"]:
+        if slot["config"] != (num_workers, quality_gate):
+            if slot["pool"] is not None:
+                slot["pool"].close()
+            slot["pool"] = None
+            if num_workers:
+                # Each worker process loads its own FaceAnalysis, outside this process's GIL
+                recognizer = InsightFaceRecognizer(model_name, FACE_DETECTION_SIZE, PROVIDERS,
+                                                   quality_gate=FaceQualityGate() if quality_gate else None)
+                slot["pool"] = InferenceWorkerPool(num_workers=num_workers, recognizer=recognizer)
+            slot["config"] = (num_workers, quality_gate)
+        return slot["pool"]
+
+worker_pool_large = load_worker_pool(MODEL_LARGE, num_inference_workers, use_quality_gate)
+worker_pool_small = load_worker_pool(MODEL_SMALL, num_inference_workers, use_quality_gate)
+
+@st.cache_resource
+def load_sharded_gallery(addresses: str) -> ShardedGallery:
+    return ShardedGallery([a.strip() for a in addresses.split(",") if a.strip()])
+
+sharded_gallery_large = load_sharded_gallery(shards_large) if shards_large.strip() else None
+sharded_gallery_small = load_sharded_gallery(shards_small) if shards_small.strip() else None
+
+@st.cache_resource
+def load_sighting_store() -> SightingStore:
+    # One writer shared by every session so chunks are not written concurrently
+    return SightingStore(SIGHTINGS_DIR)
+
+sighting_store = load_sighting_store() if record_sightings else None
+if sighting_store is not None:
+    # Read by the store on every maintenance pass, so changing it needs no new store
+    sighting_store.retention_seconds = sighting_retention_days * 86400.0
+
+@st.cache_resource
+def load_unknown_clusterer(model_name: str) -> UnknownFaceClusterer:
+    # One clusterer per model (embedding spaces differ), shared by all its streams. Both
+    # write cluster ids to the same sighting store, so each model gets its own id range.
+    return UnknownFaceClusterer(id_offset=CLUSTER_ID_OFFSETS[model_name])
+
+unknown_clusterer_large = load_unknown_clusterer(MODEL_LARGE) if cluster_unknowns else None
+unknown_clusterer_small = load_unknown_clusterer(MODEL_SMALL) if cluster_unknowns else None
+
 # --------------------------
 # Cache for Known Face Embeddings
 # --------------------------
@@ -148,113 +215,44 @@ with st.sidebar:
         )
 
 # --------------------------
-# Optimized Processor Class
+# Promote Unknown Clusters into the Gallery
 # --------------------------
-class FaceRecognitionProcessor:
-    def __init__(self, face_app, known_embeddings, known_names, similarity_threshold: float, 
-                result_queue: queue.Queue, process_every_n: int, downscale: float,
-                use_central_region: bool):
-        self.face_app = face_app
-        self.known_embeddings = known_embeddings
-        self.known_names = known_names
-        self.similarity_threshold = similarity_threshold
-        self.result_queue = result_queue
-        self.process_every_n = process_every_n
-        self.downscale = downscale
-        self.use_central_region = use_central_region
-        self.frame_count = 0
-        self.prev_time = None  # For FPS calculation
-        self.recent_fps = []  # Track recent FPS values for smoothing
+def promote_unknown_cluster(clusterer: UnknownFaceClusterer, model_name: str, label: str, name: str,
+                            known_embeddings: list, known_names: list) -> bool:
+    """Move an unknown cluster's centroid into the gallery and update the embeddings cache."""
+    centroid = clusterer.promote(label)
+    if centroid is None:
+        return False
+    if name in known_names:
+        # Merge with the existing identity, keeping one averaged embedding per person
+        idx = known_names.index(name)
+        merged = known_embeddings[idx] + centroid
+        known_embeddings[idx] = merged / np.linalg.norm(merged)
+    else:
+        known_embeddings.append(centroid)
+        known_names.append(name)
+    cache_path = Path(EMBEDDINGS_CACHE_DIR) / f"{model_name}_embeddings.pkl"
+    with open(cache_path, 'wb') as f:
+        pickle.dump({'embeddings': known_embeddings, 'names': known_names}, f)
+    return True
 
-    def process_frame(self, frame: av.VideoFrame) -> av.VideoFrame:
-        # Increment frame counter
-        self.frame_count += 1
-        
-        # Convert frame to a BGR image (numpy array)
-        img = frame.to_ndarray(format="bgr24")
-        h, w = img.shape[:2]
-        detections = []  # To store detected face info
-        
-        # Measure time for FPS calculation
-        current_time = time.time()
-        fps = 0.0
-        if self.prev_time is not None:
-            dt = current_time - self.prev_time
-            if dt > 0:
-                fps = 1.0 / dt
-                self.recent_fps.append(fps)
-                if len(self.recent_fps) > 5:  # Keep only recent 5 values
-                    self.recent_fps.pop(0)
-        self.prev_time = current_time
-        
-        # Only process every Nth frame to improve performance
-        if self.frame_count % self.process_every_n == 0:
-            # Downscale image for faster processing
-            if self.downscale > 1.0:
-                proc_img = cv2.resize(img, (int(w/self.downscale), int(h/self.downscale)))
+if cluster_unknowns:
+    with st.sidebar.expander("Unknown Face Clusters"):
+        promote_model = st.radio("Model", [MODEL_LARGE, MODEL_SMALL], horizontal=True)
+        promote_clusterer = unknown_clusterer_large if promote_model == MODEL_LARGE else unknown_clusterer_small
+        st.table(promote_clusterer.clusters(min_count=3)[:10])
+        promote_label = st.text_input("Cluster label", placeholder="unknown-1")
+        promote_name = st.text_input("Name")
+        if st.button("Promote to gallery") and promote_label and promote_name:
+            if promote_model == MODEL_LARGE:
+                gallery = (known_embeddings_large, known_names_large)
             else:
-                proc_img = img
-            
-            # Process only central region if enabled
-            if self.use_central_region:
-                ph, pw = proc_img.shape[:2]
-                # Extract center region (60% of image)
-                margin_h, margin_w = int(ph * 0.2), int(pw * 0.2)
-                central_img = proc_img[margin_h:ph-margin_h, margin_w:pw-margin_w]
-                faces = self.face_app.get(central_img)
-                # Adjust bounding box coordinates to original image space
-                scale_h, scale_w = h / (ph - 2*margin_h), w / (pw - 2*margin_w)
-                
-                for face in faces:
-                    bbox = face.bbox.astype(int)
-                    # Adjust coordinates to full image space
-                    bbox[0] = int(bbox[0] * scale_w + margin_w * (w / pw))
-                    bbox[1] = int(bbox[1] * scale_h + margin_h * (h / ph))
-                    bbox[2] = int(bbox[2] * scale_w + margin_w * (w / pw))
-                    bbox[3] = int(bbox[3] * scale_h + margin_h * (h / ph))
-                    face.bbox = bbox
+                gallery = (known_embeddings_small, known_names_small)
+            if promote_unknown_cluster(promote_clusterer, promote_model, promote_label.strip(),
+                                       promote_name.strip(), *gallery):
+                st.success(f"Promoted {promote_label} as {promote_name}")
             else:
-                # Process the entire image
-                faces = self.face_app.get(proc_img)
-                # Adjust bounding boxes if downscaling was applied
-                if self.downscale > 1.0:
-                    for face in faces:
-                        face.bbox = face.bbox * self.downscale
-            
-            # Process detected faces
-            for face in faces:
-                bbox = face.bbox.astype(int)
-                x1, y1, x2, y2 = max(0, bbox[0]), max(0, bbox[1]), min(w-1, bbox[2]), min(h-1, bbox[3])
-                
-                # Get embedding
-                emb = face.normed_embedding if hasattr(face, "normed_embedding") else face.embedding
-                emb = emb.flatten()
-                
-                # Compare to known faces
-                identity = "Unknown"
-                best_sim = -1.0
-                if self.known_embeddings:
-                    # Vectorized comparison for speed
-                    similarities = np.dot(self.known_embeddings, emb)
-                    if len(similarities) > 0:
-                        best_idx = np.argmax(similarities)
-                        best_sim = similarities[best_idx]
-                        identity = self.known_names[best_idx] if best_sim >= self.similarity_threshold else "Unknown"
-                
-                # Draw bounding box and label on the image
-                color = (0, 255, 0) if identity != "Unknown" else (0, 0, 255)
-                cv2.rectangle(img, (x1, y1), (x2, y2), color, 2)
-                cv2.putText(img, identity, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2)
-                detections.append({"Face": identity, "Similarity": round(best_sim, 2)})
-            
-        # Package results (FPS and detections) into a dictionary and push to the result queue
-        result = {"fps": np.mean(self.recent_fps) if self.recent_fps else fps, "detections": detections}
-        try:
-            self.result_queue.put_nowait(result)  # Non-blocking put
-        except queue.Full:
-            pass  # Skip if queue is full
-        
-        return av.VideoFrame.from_ndarray(img, format="bgr24")
+                st.warning(f"No live cluster named {promote_label}")
 
 # --------------------------
 # Create Result Queues & Processor Instances
@@ -270,7 +268,13 @@ processor_large = FaceRecognitionProcessor(
     result_queue=result_queue_large,
     process_every_n=process_every_n_frames,
     downscale=downscale_factor,
-    use_central_region=use_central_region
+    use_central_region=use_central_region,
+    sighting_store=sighting_store,
+    stream_id="face-recognition-large",
+    unknown_clusterer=unknown_clusterer_large,
+    worker_pool=worker_pool_large,
+    quality_gate=FaceQualityGate() if use_quality_gate else None,
+    sharded_gallery=sharded_gallery_large
 )
 
 processor_small = FaceRecognitionProcessor(
@@ -281,7 +285,13 @@ processor_small = FaceRecognitionProcessor(
     result_queue=result_queue_small,
     process_every_n=process_every_n_frames,
     downscale=downscale_factor,
-    use_central_region=use_central_region
+    use_central_region=use_central_region,
+    sighting_store=sighting_store,
+    stream_id="face-recognition-small",
+    unknown_clusterer=unknown_clusterer_small,
+    worker_pool=worker_pool_small,
+    quality_gate=FaceQualityGate() if use_quality_gate else None,
+    sharded_gallery=sharded_gallery_small
 )
 
 # --------------------------
@@ -322,7 +332,8 @@ if st.checkbox("Show Detected Data (Faces & FPS)", value=True):
             result_large = result_queue_large.get(timeout=0.1)
             fps_large = result_large.get("fps", 0)
             detections_large = result_large.get("detections", [])
-            fps_placeholder_large.markdown(f"**FPS: {fps_large:.2f}**")
+            saved_large = result_large.get("recognitions_saved", 0)
+            fps_placeholder_large.markdown(f"**FPS: {fps_large:.2f}** | Recognitions skipped: {saved_large}")
             table_placeholder_large.table(detections_large)
         except queue.Empty:
             pass
@@ -332,7 +343,8 @@ if st.checkbox("Show Detected Data (Faces & FPS)", value=True):
             result_small = result_queue_small.get(timeout=0.1)
             fps_small = result_small.get("fps", 0)
             detections_small = result_small.get("detections", [])
-            fps_placeholder_small.markdown(f"**FPS: {fps_small:.2f}**")
+            saved_small = result_small.get("recognitions_saved", 0)
+            fps_placeholder_small.markdown(f"**FPS: {fps_small:.2f}** | Recognitions skipped: {saved_small}")
             table_placeholder_small.table(detections_small)
         except queue.Empty:
             pass
@@ -355,6 +367,11 @@ with st.expander("Optimization Information"):
     - Bounded result queues to prevent memory issues
     - Vectorized face comparison for speed
     - FPS smoothing for stable metrics
+    - Optional append-only sighting log (see `sightings.py`)
+    - Online clustering of unknown faces into stable `unknown-N` labels
+    - Optional multi-process inference fed through a shared-memory frame ring
+    - Quality gate (detector score, size, pose, sharpness) ahead of the recognition model
+    - Optional sharded gallery with scatter-gather top-k across shard processes
     
     Adjust the sidebar parameters to find the optimal balance between speed and accuracy.
     """)
\ No newline at end of file
@@ -0,0 +1,63 @@
+import queue
+
+import av
+import numpy as np
+
+from processor import FaceRecognitionProcessor, LOW_QUALITY
+
+
+class OneResultPool:
+    """Pool stand-in that finishes a single frame and then has nothing new."""
+
+    def __init__(self, faces):
+        self.faces = faces
+
+    def submit(self, img, tag=None):
+        return 0
+
+    def latest(self, tag=None):
+        faces, self.faces = self.faces, None
+        return faces
+
+
+class CountingClusterer:
+    def __init__(self):
+        self.calls = 0
+
+    def assign(self, embeddings):
+        self.calls += 1
+        return ["unknown-1"] * len(embeddings)
+
+
+class CountingStore:
+    def __init__(self):
+        self.rows = 0
+
+    def append(self, *args, **kwargs):
+        self.rows += 1
+        return True
+
+
+def _face(bbox, embedding):
+    return {"bbox": np.asarray(bbox, dtype=np.float32), "kps": None, "det_score": 0.9,
+            "normed_embedding": embedding, "quality": "ok" if embedding is not None else "blurry"}
+
+
+def test_stale_pool_result_is_redrawn_not_reprocessed():
+    emb = np.zeros(8, dtype=np.float32)
+    emb[0] = 1.0
+    pool = OneResultPool([_face([10, 10, 50, 50], emb), _face([60, 10, 90, 50], None)])
+    clusterer, store = CountingClusterer(), CountingStore()
+    results = queue.Queue()
+    processor = FaceRecognitionProcessor(None, [], [], 0.3, results, 1, 1.0, False, sighting_store=store,
+                                         unknown_clusterer=clusterer, worker_pool=pool)
+    frame = av.VideoFrame.from_ndarray(np.zeros((120, 160, 3), dtype=np.uint8), format="bgr24")
+    for _ in range(10):
+        processor.process_frame(frame)
+
+    assert store.rows == 1
+    assert clusterer.calls == 1
+    assert processor.recognitions_saved == 1
+    while results.qsize() > 1:
+        results.get()
+    assert [d["Face"] for d in results.get()["detections"]] == ["unknown-1", LOW_QUALITY]
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from quality import FaceQualityGate, estimate_pose
+
+FRONTAL = np.array([[30, 40], [70, 40], [50, 60], [35, 80], [65, 80]], dtype=np.float32)
+
+
+def _rotate(kps, degrees):
+    t = np.radians(degrees)
+    rot = np.array([[np.cos(t), -np.sin(t)], [np.sin(t), np.cos(t)]], dtype=np.float32)
+    return (kps - kps[2]) @ rot.T + kps[2]
+
+
+def test_frontal_face_has_no_pose():
+    yaw, pitch, roll = estimate_pose(FRONTAL)
+    assert yaw == pytest.approx(0.0, abs=1e-3)
+    assert pitch == pytest.approx(0.0, abs=1e-3)
+    assert roll == pytest.approx(0.0, abs=1e-3)
+
+
+def test_nose_offset_gives_yaw_and_pitch():
+    kps = FRONTAL.copy()
+    kps[2] = [60, 60]  # Halfway to the right eye: sin(yaw) = 10 / 20
+    assert estimate_pose(kps)[0] == pytest.approx(30.0, abs=1e-3)
+    kps = FRONTAL.copy()
+    kps[2] = [50, 70]  # Nose three quarters of the way down to the mouth
+    assert estimate_pose(kps)[1] == pytest.approx(30.0, abs=1e-3)
+
+
+def test_roll_does_not_leak_into_yaw_or_pitch():
+    kps = FRONTAL.copy()
+    kps[2] = [60, 60]
+    yaw, pitch, roll = estimate_pose(_rotate(kps, 20))
+    assert roll == pytest.approx(20.0, abs=1e-3)
+    assert yaw == pytest.approx(30.0, abs=1e-3)
+    assert pitch == pytest.approx(estimate_pose(kps)[1], abs=1e-3)
+
+
+@pytest.fixture
+def sharp_img():
+    return np.random.default_rng(0).integers(0, 255, (200, 200, 3), dtype=np.uint8)
+
+
+def test_check_accepts_a_good_face(sharp_img):
+    gate = FaceQualityGate()
+    assert gate.check(sharp_img, [20, 20, 120, 120], FRONTAL, 0.9) is None
+
+
+def test_check_reasons_cheapest_first(sharp_img):
+    gate = FaceQualityGate()
+    turned = FRONTAL.copy()
+    turned[2] = [69, 60]
+    flat = np.full((200, 200, 3), 128, dtype=np.uint8)
+    assert gate.check(sharp_img, [20, 20, 120, 120], FRONTAL, 0.3) == "det_score"
+    assert gate.check(sharp_img, [20, 20, 40, 120], FRONTAL, 0.9) == "size"
+    assert gate.check(sharp_img, [20, 20, 120, 120], turned, 0.9) == "pose"
+    assert gate.check(flat, [20, 20, 120, 120], FRONTAL, 0.9) == "blur"
+    # A low score wins over every later check
+    assert gate.check(flat, [20, 20, 40, 40], turned, 0.1) == "det_score"
+
+
+def test_thresholds_are_configurable(sharp_img):
+    turned = FRONTAL.copy()
+    turned[2] = [69, 60]
+    assert FaceQualityGate(max_yaw=90.0).check(sharp_img, [20, 20, 120, 120], turned, 0.9) is None
+    assert FaceQualityGate(min_face_size=10).check(sharp_img, [20, 20, 40, 120], FRONTAL, 0.9) is None
@@ -0,0 +1,108 @@
+import os
+import shutil
+
+import numpy as np
+
+from sightings import SightingStore
+
+
+def _bbox():
+    return [10.0, 20.0, 30.0, 40.0]
+
+
+def test_query_embeddings_when_store_has_none(tmp_path):
+    store = SightingStore(str(tmp_path), store_embeddings=False)
+    store.append(1.0, "cam1", "Alice", 0.9, _bbox(), np.ones(4, dtype=np.float32))
+    store.flush()
+    result = store.query(with_embeddings=True)
+    store.close()
+    assert list(result["identity"]) == ["Alice"]
+    assert result["embedding"] is None
+
+
+def test_query_embeddings_when_rows_have_none(tmp_path):
+    store = SightingStore(str(tmp_path))
+    store.append(1.0, "cam1", "Alice", 0.9, _bbox())
+    store.append(2.0, "cam1", "Bob", 0.8, _bbox())
+    store.flush()
+    result = store.query(with_embeddings=True)
+    store.close()
+    assert list(result["identity"]) == ["Alice", "Bob"]
+    assert result["embedding"] is None
+
+
+def test_compaction_keeps_rows_and_identity_index(tmp_path):
+    store = SightingStore(str(tmp_path), compact_fanin=4, maintenance_interval=3600)
+    rng = np.random.default_rng(0)
+    for chunk in range(8):
+        for i in range(10):
+            ts = chunk * 100 + i
+            emb = rng.normal(size=8).astype(np.float32) if chunk % 2 else None
+            store.append(ts, f"cam{i % 2}", f"person{i % 3}", 0.5, _bbox(), emb)
+        store.flush()
+    assert store.stats()["chunks"] == 8
+    assert store.compact() == 2
+    assert store.stats()["chunks"] == 2
+
+    everyone = store.query(with_embeddings=True)
+    assert everyone["ts"].shape[0] == 80
+    assert np.all(np.diff(everyone["ts"]) >= 0)
+    assert np.isnan(everyone["embedding"][everyone["ts"] < 100]).all()
+
+    alice = store.query(identity="person1", stream="cam1", start=100, end=450)
+    assert set(alice["identity"]) == {"person1"} and set(alice["stream"]) == {"cam1"}
+    assert list(alice["ts"]) == [101, 107, 201, 207, 301, 307, 401, 407]
+    assert store.last_seen("person2") == 708
+    assert store.last_seen("person2", "cam1") == 705
+    store.close()
+
+    reopened = SightingStore(str(tmp_path))
+    assert reopened.query()["ts"].shape[0] == 80
+    reopened.close()
+
+
+def test_retention_drops_old_chunks(tmp_path):
+    store = SightingStore(str(tmp_path), retention_seconds=50, maintenance_interval=3600)
+    store.append(1.0, "cam1", "Alice", 0.9, _bbox())
+    store.flush()
+    store.append(100.0, "cam1", "Alice", 0.9, _bbox())
+    store.flush()
+    assert store.apply_retention(now=120.0) == 1
+    assert list(store.query(identity="Alice")["ts"]) == [100.0]
+    assert not [e for e in os.listdir(tmp_path) if e.endswith(".trash")]
+    store.close()
+
+
+def test_unknown_clusters_share_one_identity(tmp_path):
+    store = SightingStore(str(tmp_path))
+    for n in range(100):
+        store.append(float(n), "cam1", "Unknown", 0.1, _bbox(), cluster=n)
+    store.append(100.0, "cam1", "Alice", 0.9, _bbox())
+    store.flush()
+    unknown = store.query(identity="Unknown")
+    assert list(unknown["cluster"]) == list(range(100))
+    assert list(store.query(identity="Alice")["cluster"]) == [-1]
+    store.close()
+    assert len(store._names) == 3
+
+
+def test_crash_after_merge_does_not_duplicate_rows(tmp_path):
+    store = SightingStore(str(tmp_path), compact_fanin=2, maintenance_interval=3600)
+    for ts in (1.0, 2.0):
+        store.append(ts, "cam1", "Alice", 0.9, _bbox())
+        store.flush()
+    sources = sorted(e for e in os.listdir(tmp_path) if e.startswith("chunk_"))
+    backup = {name: tmp_path / (name + ".bak") for name in sources}
+    for name, bak in backup.items():
+        shutil.copytree(tmp_path / name, bak)
+    assert store.compact() == 1
+    store.close()
+    # Simulate a crash after the merged chunk was published but before its sources were removed
+    for name, bak in backup.items():
+        os.rename(bak, tmp_path / name)
+
+    reopened = SightingStore(str(tmp_path))
+    assert list(reopened.query(identity="Alice")["ts"]) == [1.0, 2.0]
+    assert reopened.stats()["chunks"] == 1
+    assert not (set(sources) & set(os.listdir(tmp_path)))
+    reopened.close()
@@ -0,0 +1,57 @@
+import numpy as np
+
+from unknown_clusters import UnknownFaceClusterer, cluster_id, is_unknown
+
+
+def _basis(i, dim=8):
+    v = np.zeros(dim, dtype=np.float32)
+    v[i] = 1.0
+    return v
+
+
+def test_labels_are_stable_and_never_reused():
+    clusterer = UnknownFaceClusterer(dim=8, max_clusters=4)
+    first = clusterer.assign(np.stack([_basis(0), _basis(1)]))
+    assert first == ["unknown-1", "unknown-2"]
+    assert clusterer.assign(np.stack([_basis(1), _basis(0)])) == ["unknown-2", "unknown-1"]
+    # A stranger seen twice in one batch seeds a single cluster
+    assert clusterer.assign(np.stack([_basis(2), _basis(2)])) == ["unknown-3", "unknown-3"]
+    assert clusterer.promote("unknown-3") is not None
+    assert clusterer.assign(_basis(2)[None]) == ["unknown-4"]
+
+
+def test_full_table_evicts_least_recently_seen():
+    clusterer = UnknownFaceClusterer(dim=8, max_clusters=3)
+    for i in range(3):
+        clusterer.assign(_basis(i)[None])
+    clusterer.assign(_basis(0)[None])  # unknown-2 is now the least recently seen
+    clusterer.assign(_basis(2)[None])
+    assert clusterer.assign(_basis(3)[None]) == ["unknown-4"]
+    assert clusterer.evicted == 1
+    labels = {c["Label"] for c in clusterer.clusters()}
+    assert labels == {"unknown-1", "unknown-3", "unknown-4"}
+    # The evicted face comes back as a new cluster rather than its old label
+    assert clusterer.assign(_basis(1)[None]) == ["unknown-5"]
+
+
+def test_promote_moves_last_slot_into_the_hole():
+    clusterer = UnknownFaceClusterer(dim=8, max_clusters=4)
+    clusterer.assign(np.stack([_basis(0), _basis(1), _basis(2)]))
+    centroid = clusterer.promote("unknown-1")
+    np.testing.assert_allclose(centroid, _basis(0), atol=1e-6)
+    assert clusterer.promote("unknown-1") is None
+    assert clusterer.promote("Alice") is None
+    assert {c["Label"] for c in clusterer.clusters()} == {"unknown-2", "unknown-3"}
+    # unknown-3 now lives in slot 0 and still matches its own face
+    assert clusterer._slot_of == {2: 1, 3: 0}
+    assert clusterer.assign(np.stack([_basis(2), _basis(1)])) == ["unknown-3", "unknown-2"]
+
+
+def test_id_offset_keeps_clusterers_apart():
+    large = UnknownFaceClusterer(dim=8)
+    small = UnknownFaceClusterer(dim=8, id_offset=1_000_000_000)
+    a, = large.assign(_basis(0)[None])
+    b, = small.assign(_basis(0)[None])
+    assert is_unknown(a) and is_unknown(b)
+    assert cluster_id(a) == 1 and cluster_id(b) == 1_000_000_001
+    assert cluster_id("Alice") == -1 and cluster_id("unknown-x") == -1
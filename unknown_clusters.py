@@ -0,0 +1,223 @@
+import time
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# --------------------------
+# Configuration
+# --------------------------
+MAX_CLUSTERS = 2000          # Hard cap on live clusters (memory = MAX_CLUSTERS * dim * 4 bytes)
+CLUSTER_THRESHOLD = 0.45     # Cosine similarity needed to join an existing cluster
+MAX_CENTROID_WEIGHT = 50     # Cap on the running-mean weight so centroids keep adapting
+UNKNOWN_PREFIX = "unknown-"
+
+
+def is_unknown(identity: str) -> bool:
+    return identity == "Unknown" or identity.startswith(UNKNOWN_PREFIX)
+
+
+def cluster_id(label: str) -> int:
+    """N for an "unknown-N" label, or -1 for anything else."""
+    if not label.startswith(UNKNOWN_PREFIX):
+        return -1
+    try:
+        return int(label[len(UNKNOWN_PREFIX):])
+    except ValueError:
+        return -1
+
+
+class UnknownFaceClusterer:
+    """Online clustering of unknown face embeddings with bounded memory.
+
+    Centroids live in one preallocated (max_clusters, dim) matrix, so assigning a
+    batch is a single matrix product. Each cluster gets a stable "unknown-N" label
+    that is never reused. When the cap is reached, the least recently seen
+    cluster is evicted to make room. One instance can be shared across streams.
+    Clusterers whose labels end up in the same place (e.g. one per model writing
+    to one sighting store) need disjoint `id_offset`s so their N never collide.
+    """
+
+    def __init__(self, dim: int = 512, max_clusters: int = MAX_CLUSTERS,
+                 threshold: float = CLUSTER_THRESHOLD, max_weight: int = MAX_CENTROID_WEIGHT,
+                 id_offset: int = 0):
+        self.dim = dim
+        self.max_clusters = max_clusters
+        self.threshold = threshold
+        self.max_weight = max_weight
+        self._lock = threading.Lock()
+
+        self._centroids = np.zeros((max_clusters, dim), dtype=np.float32)
+        self._counts = np.zeros(max_clusters, dtype=np.int64)      # Faces assigned so far
+        self._last_seen = np.zeros(max_clusters, dtype=np.int64)   # Logical clock for LRU eviction
+        self._ids = np.zeros(max_clusters, dtype=np.int64)         # N in "unknown-N"
+        self._slot_of: Dict[int, int] = {}                          # N -> slot
+        self._size = 0   # Live clusters are always packed into slots [0, _size)
+        self._next_id = id_offset + 1
+        self._clock = 0
+        self.evicted = 0
+
+    # --------------------------
+    # Assignment
+    # --------------------------
+    def assign(self, embeddings) -> List[str]:
+        """Assign each embedding to a cluster, creating clusters as needed. Returns labels."""
+        emb = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim)
+        if emb.shape[0] == 0:
+            return []
+        emb = emb / np.maximum(np.linalg.norm(emb, axis=1, keepdims=True), 1e-12)
+
+        with self._lock:
+            self._clock += 1
+            slots = np.full(emb.shape[0], -1, dtype=np.int64)
+
+            # Vectorized pass against the existing centroids
+            if self._size:
+                sims = emb @ self._centroids[:self._size].T
+                best = np.argmax(sims, axis=1)
+                hit = sims[np.arange(emb.shape[0]), best] >= self.threshold
+                slots[hit] = best[hit]
+                self._last_seen[best[hit]] = self._clock
+
+            # Misses are few; handle them one by one so a stranger appearing several
+            # times in the same batch seeds a single cluster
+            for i in np.flatnonzero(slots < 0):
+                if self._size:
+                    sims = self._centroids[:self._size] @ emb[i]
+                    j = int(np.argmax(sims))
+                    if sims[j] >= self.threshold:
+                        slots[i] = j
+                        continue
+                slots[i] = self._new_cluster_locked(emb[i], sims if self._size else None)
+
+            self._update_locked(slots, emb)
+            return [UNKNOWN_PREFIX + str(n) for n in self._ids[slots]]
+
+    def _update_locked(self, slots: np.ndarray, emb: np.ndarray):
+        # Weighted running mean; new clusters start at weight 0 so their seed is counted once
+        uniq, inverse = np.unique(slots, return_inverse=True)
+        sums = np.zeros((uniq.shape[0], self.dim), dtype=np.float32)
+        np.add.at(sums, inverse, emb)
+        w = np.minimum(self._counts[uniq], self.max_weight).astype(np.float32)
+        merged = self._centroids[uniq] * w[:, None] + sums
+        merged /= np.maximum(np.linalg.norm(merged, axis=1, keepdims=True), 1e-12)
+        self._centroids[uniq] = merged
+        self._counts[uniq] += np.bincount(inverse, minlength=uniq.shape[0])
+        self._last_seen[uniq] = self._clock
+
+    def _new_cluster_locked(self, emb: np.ndarray, sims: Optional[np.ndarray]) -> int:
+        if self._size < self.max_clusters:
+            slot = self._size
+            self._size += 1
+        else:
+            # Evict the least recently seen cluster that this batch has not touched;
+            # if the whole table was touched, fall back to the nearest cluster
+            stale = self._last_seen[:self._size] < self._clock
+            if not stale.any():
+                return int(np.argmax(sims))
+            slot = int(np.argmin(np.where(stale, self._last_seen[:self._size], np.iinfo(np.int64).max)))
+            del self._slot_of[int(self._ids[slot])]
+            self.evicted += 1
+        self._centroids[slot] = emb
+        self._counts[slot] = 0
+        self._last_seen[slot] = self._clock
+        self._ids[slot] = self._next_id
+        self._slot_of[self._next_id] = slot
+        self._next_id += 1
+        return slot
+
+    # --------------------------
+    # Operator actions
+    # --------------------------
+    def clusters(self, min_count: int = 1) -> List[Dict]:
+        """Live clusters, largest first."""
+        with self._lock:
+            order = np.argsort(-self._counts[:self._size], kind="stable")
+            return [
+                {"Label": UNKNOWN_PREFIX + str(self._ids[s]), "Faces": int(self._counts[s])}
+                for s in order if self._counts[s] >= min_count
+            ]
+
+    def promote(self, label: str) -> Optional[np.ndarray]:
+        """Remove a cluster and return its normalized centroid for adding to the gallery."""
+        with self._lock:
+            slot = self._slot_of.pop(cluster_id(label), None)
+            if slot is None:
+                return None
+            centroid = self._centroids[slot].copy()
+            # Keep live slots packed by moving the last cluster into the hole
+            last = self._size - 1
+            if slot != last:
+                self._centroids[slot] = self._centroids[last]
+                self._counts[slot] = self._counts[last]
+                self._last_seen[slot] = self._last_seen[last]
+                self._ids[slot] = self._ids[last]
+                self._slot_of[int(self._ids[slot])] = slot
+            self._size = last
+            return centroid
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "clusters": self._size,
+                "evicted": self.evicted,
+                "memory_bytes": int(self._centroids.nbytes + self._counts.nbytes
+                                    + self._last_seen.nbytes + self._ids.nbytes),
+            }
+
+
+# --------------------------
+# Throughput Benchmark
+# --------------------------
+def benchmark(n_faces: int = 50000, n_people: int = 300, batch: int = 4, dim: int = 512,
+              noise: float = 0.9, max_clusters: int = MAX_CLUSTERS, seed: int = 0) -> Dict[str, float]:
+    """Feed synthetic unknown embeddings in per-frame batches and measure throughput.
+
+    Each synthetic person has a random unit "identity" vector; each sighting adds
+    Gaussian noise scaled so its cosine similarity to the identity is roughly
+    1 / sqrt(1 + noise^2), which mimics same-person embedding spread.
+    """
+    rng = np.random.default_rng(seed)
+    people = rng.standard_normal((n_people, dim)).astype(np.float32)
+    people /= np.linalg.norm(people, axis=1, keepdims=True)
+    who = rng.integers(0, n_people, n_faces)
+    faces = people[who] + rng.standard_normal((n_faces, dim)).astype(np.float32) * (noise / np.sqrt(dim))
+
+    clusterer = UnknownFaceClusterer(dim=dim, max_clusters=max_clusters)
+    labels = []
+    start = time.perf_counter()
+    for i in range(0, n_faces, batch):
+        labels.extend(clusterer.assign(faces[i:i + batch]))
+    elapsed = time.perf_counter() - start
+
+    # Purity: share of faces whose cluster's majority person is their own person
+    majority = {}
+    for label, person in zip(labels, who):
+        majority.setdefault(label, []).append(person)
+    correct = sum(np.bincount(p).max() for p in majority.values())
+
+    return {
+        "faces": n_faces,
+        "seconds": elapsed,
+        "faces_per_hour": n_faces / elapsed * 3600,
+        "clusters": clusterer.stats()["clusters"],
+        "labels_used": len(majority),
+        "purity": correct / n_faces,
+        "memory_mb": clusterer.stats()["memory_bytes"] / 1e6,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark online clustering of unknown faces")
+    parser.add_argument("--faces", type=int, default=50000)
+    parser.add_argument("--people", type=int, default=300)
+    parser.add_argument("--batch", type=int, default=4, help="Unknown faces per frame")
+    parser.add_argument("--max-clusters", type=int, default=MAX_CLUSTERS)
+    args = parser.parse_args()
+
+    result = benchmark(n_faces=args.faces, n_people=args.people, batch=args.batch,
+                       max_clusters=args.max_clusters)
+    for key, value in result.items():
+        print(f"{key:>14}: {value:,.3f}" if isinstance(value, float) else f"{key:>14}: {value:,}")
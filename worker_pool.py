@@ -0,0 +1,350 @@
+import os
+import time
+import queue
+import threading
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# --------------------------
+# Configuration
+# --------------------------
+PROVIDERS = ['CUDAExecutionProvider', 'CPUExecutionProvider']
+FACE_DETECTION_SIZE = (320, 320)
+MAX_FRAME_SHAPE = (1080, 1920, 3)  # Largest frame a ring slot can hold
+SLOTS_PER_WORKER = 2               # In-flight frames per worker before new frames are dropped
+RESULT_TTL = 10.0                  # Seconds an unread result is kept before its tag is presumed gone
+SYNTHETIC_ITERATIONS = 750         # Blur passes per synthetic frame (~30 ms on one modern core)
+
+
+# --------------------------
+# Recognizers (constructed inside each worker process)
+# --------------------------
+class InsightFaceRecognizer:
+    """Runs FaceAnalysis in a worker. Only the config is pickled; the model loads lazily."""
+
+    def __init__(self, model_name: str = "buffalo_s", det_size=FACE_DETECTION_SIZE, providers=PROVIDERS,
+                 quality_gate=None):
+        self.model_name = model_name
+        self.det_size = det_size
+        self.providers = providers
+        self.quality_gate = quality_gate
+        self.app = None
+
+    def __call__(self, img: np.ndarray) -> List[Dict]:
+        if self.app is None:
+            from insightface.app import FaceAnalysis
+            self.app = FaceAnalysis(name=self.model_name, providers=self.providers)
+            self.app.prepare(ctx_id=0, det_size=self.det_size)
+        detected = self.quality_gate.get(self.app, img) if self.quality_gate else self.app.get(img)
+        faces = []
+        for face in detected:
+            emb = face.normed_embedding if hasattr(face, "normed_embedding") else face.embedding
+            faces.append({
+                "bbox": np.asarray(face.bbox, dtype=np.float32),
+                "kps": None if face.kps is None else np.asarray(face.kps, dtype=np.float32),
+                "det_score": float(face.det_score),
+                "normed_embedding": None if emb is None else np.asarray(emb, dtype=np.float32).flatten(),
+                "quality": face.quality or "ok",
+            })
+        return faces
+
+
+class SyntheticRecognizer:
+    """Does a fixed amount of single-threaded work per frame; used for scaling benchmarks.
+
+    The cost is an iteration count, not a duration: a time budget would finish
+    on schedule even when workers share one core and so overstate the speedup.
+    """
+
+    def __init__(self, iterations: int = SYNTHETIC_ITERATIONS, dim: int = 512):
+        self.iterations = iterations
+        self.dim = dim
+
+    def __call__(self, img: np.ndarray) -> List[Dict]:
+        small = cv2.resize(img, (160, 120))
+        for _ in range(self.iterations):
+            small = cv2.GaussianBlur(small, (5, 5), 0)
+        h, w = img.shape[:2]
+        emb = np.zeros(self.dim, dtype=np.float32)
+        emb[0] = 1.0
+        return [{"bbox": np.array([w * 0.4, h * 0.4, w * 0.6, h * 0.6], dtype=np.float32),
+                 "kps": None, "det_score": 0.9, "normed_embedding": emb, "quality": "ok"}]
+
+
+def _worker_main(worker_id: int, shm_name: str, ring_shape: Tuple[int, ...], task_queue, result_queue,
+                 recognizer):
+    # Keep OpenCV to one thread per worker; parallelism comes from the process count
+    cv2.setNumThreads(1)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    ring = np.ndarray(ring_shape, dtype=np.uint8, buffer=shm.buf)
+    try:
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+            seq, slot, h, w = task
+            # Copy out of the ring so the slot can be reused as soon as we report back
+            img = np.ascontiguousarray(ring[slot, :h, :w])
+            try:
+                faces = recognizer(img)
+                result_queue.put((worker_id, seq, faces, None))
+            except Exception as e:
+                result_queue.put((worker_id, seq, [], repr(e)))
+    finally:
+        del ring
+        shm.close()
+
+
+# --------------------------
+# Worker Pool
+# --------------------------
+class InferenceWorkerPool:
+    """N worker processes fed through a shared-memory frame ring.
+
+    Frames are copied into a free ring slot and only (seq, slot, h, w) is sent to a
+    worker, so pixels are never pickled. Workers send back face dicts (bbox, kps,
+    score, embedding). Crashed workers are restarted and their in-flight frames
+    are reported as dropped. Results are routed by tag so several streams can
+    share one pool.
+    """
+
+    def __init__(self, num_workers: int = 2, recognizer=None, frame_shape=MAX_FRAME_SHAPE,
+                 slots_per_worker: int = SLOTS_PER_WORKER, start_method: str = "spawn"):
+        self.num_workers = num_workers
+        self.recognizer = recognizer if recognizer is not None else InsightFaceRecognizer()
+        self.frame_shape = tuple(frame_shape)
+        self.num_slots = num_workers * slots_per_worker
+        self._ctx = mp.get_context(start_method)
+        self._lock = threading.Lock()
+        self._closed = False
+
+        ring_shape = (self.num_slots,) + self.frame_shape
+        self._shm = shared_memory.SharedMemory(create=True, size=int(np.prod(ring_shape)))
+        self._ring = np.ndarray(ring_shape, dtype=np.uint8, buffer=self._shm.buf)
+        self._ring_shape = ring_shape
+
+        self._free_slots = list(range(self.num_slots))
+        self._inflight: Dict[int, Tuple[int, int, object]] = {}  # seq -> (worker_id, slot, tag)
+        self._latest: Dict[object, Tuple[int, List[Dict], float]] = {}  # tag -> (seq, faces, arrival time)
+        self._next_seq = 0
+        self._rr = 0
+
+        self._result_queue = self._ctx.Queue()
+        self._task_queues = [None] * num_workers
+        self._workers = [None] * num_workers
+        for worker_id in range(num_workers):
+            self._start_worker(worker_id)
+
+        self.submitted = 0
+        self.completed = 0
+        self.dropped = 0    # Frames refused because every slot was busy
+        self.lost = 0       # In-flight frames lost to a worker crash
+        self.errors = 0
+        self.restarts = 0
+
+    def _start_worker(self, worker_id: int):
+        task_queue = self._ctx.Queue()
+        proc = self._ctx.Process(
+            target=_worker_main,
+            args=(worker_id, self._shm.name, self._ring_shape, task_queue, self._result_queue, self.recognizer),
+            name=f"face-worker-{worker_id}",
+            daemon=True,
+        )
+        proc.start()
+        self._task_queues[worker_id] = task_queue
+        self._workers[worker_id] = proc
+
+    # --------------------------
+    # Producer side
+    # --------------------------
+    def submit(self, img: np.ndarray, tag=None) -> Optional[int]:
+        """Copy a frame into the ring and dispatch it. Returns its seq, or None if dropped."""
+        h, w = img.shape[:2]
+        if h > self.frame_shape[0] or w > self.frame_shape[1]:
+            raise ValueError(f"Frame {img.shape} does not fit ring slot {self.frame_shape}")
+        with self._lock:
+            if self._closed:
+                return None
+            self._poll_locked()
+            if not self._free_slots:
+                self.dropped += 1
+                return None
+            slot = self._free_slots.pop()
+            self._ring[slot, :h, :w] = img
+
+            # Least-loaded worker, ties broken round-robin
+            load = [0] * self.num_workers
+            for worker_id, _, _ in self._inflight.values():
+                load[worker_id] += 1
+            order = [(self._rr + i) % self.num_workers for i in range(self.num_workers)]
+            worker_id = min(order, key=lambda i: load[i])
+            self._rr = (worker_id + 1) % self.num_workers
+
+            seq = self._next_seq
+            self._next_seq += 1
+            self._inflight[seq] = (worker_id, slot, tag)
+            self._task_queues[worker_id].put((seq, slot, h, w))
+            self.submitted += 1
+            return seq
+
+    # --------------------------
+    # Consumer side
+    # --------------------------
+    def latest(self, tag=None) -> Optional[List[Dict]]:
+        """Newest unread result for `tag`, or None if nothing new has arrived."""
+        with self._lock:
+            if self._closed:
+                return None
+            self._poll_locked()
+            entry = self._latest.pop(tag, None)
+        return None if entry is None else entry[1]
+
+    def discard(self, tag):
+        """Forget any unread result for a tag whose consumer has gone away."""
+        with self._lock:
+            self._latest.pop(tag, None)
+
+    def wait(self, timeout: float = 1.0) -> bool:
+        """Block until at least one in-flight frame completes (or timeout)."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if self._closed:
+                    return True
+                before = self.completed + self.lost
+                self._poll_locked(block_timeout=0.01)
+                if self.completed + self.lost > before or not self._inflight:
+                    return True
+        return False
+
+    def _poll_locked(self, block_timeout: float = 0.0):
+        block = block_timeout > 0
+        while True:
+            try:
+                if block:
+                    msg = self._result_queue.get(timeout=block_timeout)
+                    block = False
+                else:
+                    msg = self._result_queue.get_nowait()
+            except queue.Empty:
+                break
+            worker_id, seq, faces, error = msg
+            entry = self._inflight.pop(seq, None)
+            if entry is None:
+                continue  # Already written off when its worker was restarted
+            _, slot, tag = entry
+            self._free_slots.append(slot)
+            self.completed += 1
+            if error is not None:
+                self.errors += 1
+                continue
+            prev = self._latest.get(tag)
+            if prev is None or prev[0] < seq:
+                self._latest[tag] = (seq, faces, time.monotonic())
+        # Consumers that stopped reading (e.g. a closed session) never pop their tag
+        cutoff = time.monotonic() - RESULT_TTL
+        for tag in [t for t, (_, _, arrived) in self._latest.items() if arrived < cutoff]:
+            del self._latest[tag]
+        self._check_workers_locked()
+
+    def _check_workers_locked(self):
+        for worker_id, proc in enumerate(self._workers):
+            if proc.is_alive():
+                continue
+            # Write off the dead worker's frames and release their slots
+            for seq, (owner, slot, _) in list(self._inflight.items()):
+                if owner == worker_id:
+                    del self._inflight[seq]
+                    self._free_slots.append(slot)
+                    self.lost += 1
+            self._task_queues[worker_id].close()
+            self.restarts += 1
+            self._start_worker(worker_id)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "workers": self.num_workers,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "in_flight": len(self._inflight),
+                "dropped": self.dropped,
+                "lost": self.lost,
+                "errors": self.errors,
+                "restarts": self.restarts,
+            }
+
+    def close(self):
+        """Stop the workers and free the ring. Later submit/latest calls are no-ops."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            for task_queue in self._task_queues:
+                task_queue.put(None)
+            for proc in self._workers:
+                proc.join(timeout=5.0)
+                if proc.is_alive():
+                    proc.terminate()
+            del self._ring
+            self._shm.close()
+            self._shm.unlink()
+
+
+# --------------------------
+# Scaling Benchmark
+# --------------------------
+def benchmark(max_workers: int = None, frames: int = 300, iterations: int = SYNTHETIC_ITERATIONS, model_name: str = None,
+              frame_shape=(480, 640, 3)) -> List[Dict[str, float]]:
+    """Measure pool throughput for 1..max_workers workers.
+
+    Uses SyntheticRecognizer (fixed CPU cost per frame) unless a model name is given.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    frame = np.random.default_rng(0).integers(0, 255, frame_shape, dtype=np.uint8)
+    rows = []
+    for n in range(1, max_workers + 1):
+        recognizer = InsightFaceRecognizer(model_name) if model_name else SyntheticRecognizer(iterations)
+        pool = InferenceWorkerPool(num_workers=n, recognizer=recognizer, frame_shape=frame_shape)
+        # Warm up so model loading and process start-up are not timed
+        for _ in range(n):
+            pool.submit(frame)
+        while pool.stats()["in_flight"]:
+            pool.wait()
+
+        start = time.perf_counter()
+        done_before = pool.completed
+        sent = 0
+        while sent < frames:
+            if pool.submit(frame) is None:
+                pool.wait()
+            else:
+                sent += 1
+        while pool.stats()["in_flight"]:
+            pool.wait()
+        elapsed = time.perf_counter() - start
+        fps = (pool.completed - done_before) / elapsed
+        rows.append({"workers": n, "fps": fps, "speedup": fps / rows[0]["fps"] if rows else 1.0,
+                     "restarts": pool.restarts})
+        pool.close()
+    return rows
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Scaling benchmark for the shared-memory worker pool")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count())
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--iterations", type=int, default=SYNTHETIC_ITERATIONS,
+                        help="Blur passes per frame for the synthetic recognizer")
+    parser.add_argument("--model", default=None, help="InsightFace model pack to benchmark instead, e.g. buffalo_s")
+    args = parser.parse_args()
+
+    print(f"{'workers':>8} {'fps':>10} {'speedup':>8}")
+    for row in benchmark(args.max_workers, args.frames, args.iterations, args.model):
+        print(f"{row['workers']:>8} {row['fps']:>10.1f} {row['speedup']:>8.2f}")